@@ -0,0 +1,121 @@
+import errno
+import logging
+import select
+import time
+
+import ethtool
+import hotplug
+import sysfs_hw
+import timing
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_RECONCILE_INTERVAL = 3600.0
+
+
+class AgentDaemon():
+    """
+    Long-running mode: listens for netlink link and address events and
+    pushes only the interfaces they touch to NetBox, once a burst of events
+    has been quiet for debounce seconds. A full sync runs at start and
+    every reconcile_interval seconds as a safety net.
+
+    When PCI devices can be read from sysfs, a HotplugWatcher runs beside
+    it to keep the hardware inventory current between full syncs.
+    """
+    def __init__(self, agent, debounce=DEFAULT_DEBOUNCE,
+        reconcile_interval=DEFAULT_RECONCILE_INTERVAL):
+        self.agent = agent
+        self.debounce = debounce
+        self.reconcile_interval = reconcile_interval
+        self.pending = set()
+        self.last_event = None
+        self.next_reconcile = 0
+
+    def reconcile(self):
+        logging.info('Running full sync')
+        self.next_reconcile = time.monotonic() + self.reconcile_interval
+        with self.agent.sync_lock, timing.run('reconcile') as root:
+            # Start from fresh NetBox and hardware state. Under the lock, so
+            # a hotplug flush in progress never sees the state missing.
+            self.agent.state = None
+            self.agent.writer.reset()
+            ethtool.clear_cache()
+            try:
+                self.agent.update_interfaces()
+                self.agent.update_pci()
+            finally:
+                self.agent.write_metrics()
+        logging.info('Sync timings\n' + root.format())
+        self.pending.clear()
+
+    def event_ifname(self, msg):
+        if msg['event'] in ('RTM_NEWLINK', 'RTM_DELLINK'):
+            return msg.get_attr('IFLA_IFNAME')
+        elif msg['event'] in ('RTM_NEWADDR', 'RTM_DELADDR'):
+            link = self.agent.links.by_index.get(msg['index'])
+            if link != None:
+                return link.name
+            return msg.get_attr('IFA_LABEL')
+        return None
+
+    def handle(self, msgs):
+        for msg in msgs:
+            ifname = self.event_ifname(msg)
+            if ifname != None:
+                logging.debug('{0} for {1}'.format(msg['event'], ifname))
+                self.pending.add(ifname)
+                self.last_event = time.monotonic()
+
+    def receive(self, ip):
+        try:
+            self.handle(ip.get())
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+            # The socket buffer overflowed and events were lost: only a
+            # full sync can tell what changed
+            logging.warning('Netlink events lost, scheduling a full sync')
+            self.next_reconcile = 0
+
+    def push_pending(self):
+        ifnames, self.pending = sorted(self.pending), set()
+        with self.agent.sync_lock, timing.run('push changes') as root:
+            try:
+                self.agent.update_changed_interfaces(ifnames)
+            finally:
+                self.agent.write_metrics()
+        logging.debug('Sync timings\n' + root.format())
+
+    def timeout(self):
+        now = time.monotonic()
+        deadline = self.next_reconcile
+        if self.pending:
+            deadline = min(deadline, self.last_event + self.debounce)
+        return max(0, deadline - now)
+
+    def run(self):
+        if sysfs_hw.available(self.agent.sysfs_root):
+            hotplug.HotplugWatcher(self.agent).start()
+
+        import pyroute2
+        from pyroute2.netlink.rtnl import (RTMGRP_LINK, RTMGRP_IPV4_IFADDR,
+            RTMGRP_IPV6_IFADDR)
+
+        with pyroute2.IPRoute() as ip:
+            ip.bind(groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR |
+                RTMGRP_IPV6_IFADDR)
+            while True:
+                try:
+                    if time.monotonic() >= self.next_reconcile:
+                        self.reconcile()
+                    ready, _, _ = select.select([ip], [], [], self.timeout())
+                    if ready:
+                        self.receive(ip)
+                    elif (self.pending and time.monotonic() >=
+                        self.last_event + self.debounce):
+                        self.push_pending()
+                except KeyboardInterrupt:
+                    raise
+                except Exception:
+                    logging.exception('Sync failed, retrying at the next '
+                        'event or reconcile')
@@ -0,0 +1,134 @@
+"""
+Timings of each discovery parser and probe on synthetic inputs from
+fixtures.py, sized like a large host.
+
+    python3 bench/bench_discovery.py [--nics 256] [--veths 2000] ...
+
+Command output (lshw, ethtool, cat) is served from the fixtures instead
+of running the commands, so only the parsing is timed.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import dmidecode
+import ethtool
+import lshw
+import netlink_tables
+import smbios
+import snapshot
+import sysfs_hw
+
+import fixtures
+
+
+def timed(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def command_output(outputs):
+    """A run_command replacement answering from {command prefix: output}."""
+    def run_command(cmd, ignore_stderr=False):
+        for prefix, output in outputs.items():
+            if cmd.startswith(prefix):
+                return [output, '']
+        raise ValueError('No fixture for ' + cmd)
+    return run_command
+
+
+def decode_tables(link_msgs, addr_msgs):
+    from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+    from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+
+    def decode(cls, data):
+        msg = cls(data)
+        msg.decode()
+        return msg
+
+    links = netlink_tables.LinkTable(netlink_tables.decode_link(decode(
+        ifinfmsg, data)) for data in link_msgs)
+    return links, netlink_tables.AddressTable(links, [netlink_tables.
+        decode_addr(decode(ifaddrmsg, data)) for data in addr_msgs])
+
+
+def phy_ints(links):
+    for name in links.by_name:
+        if links.phy_int(name) not in (None, name):
+            links.vid(name)
+
+
+def ifaddresses(addrs):
+    for name in addrs.interfaces():
+        addrs.ifaddresses(name)
+
+
+def run(args, root):
+    nodes = fixtures.lshw_nodes(args.nics, args.nvmes)
+    ifnames = ['ens{}f0'.format(i) for i in range(args.nics)]
+    lshw.run_command = command_output({'lshw -json' : fixtures.lshw_json(
+        nodes), 'lshw -class' : fixtures.lshw_text(nodes),
+        'cat ' : 'SAMSUNG MZ1LB960HAJQ-00007\n'})
+    lshw.get_nvme_model = lambda pci_addr: 'SAMSUNG MZ1LB960HAJQ-00007'
+    ethtool.run_command = command_output({'ethtool ' :
+        fixtures.ethtool_output('ens0f0')})
+
+    dump = fixtures.dmidecode_dump(args.processors, args.dimms)
+    entry_point, table = fixtures.smbios_tables(args.processors, args.dimms)
+    fixtures.sysfs_tree(root, args.nics, args.nvmes, args.cpus)
+    link_msgs, addr_msgs = fixtures.netlink_dump(args.veths, args.vlans)
+    links, addrs = decode_tables(link_msgs, addr_msgs)
+    snap_links = snapshot.collect_links(links, addrs)
+
+    return [
+        ('lshw.get_hw_linux network+storage', lambda: [lshw.get_hw_linux(
+            cls, 1) for cls in ('network', 'storage')]),
+        ('lshw.get_hw_linux_json', lambda: lshw.get_hw_linux_json(1)),
+        ('sysfs_hw.get_hw', lambda: sysfs_hw.get_hw(1, root)),
+        ('ethtool.get_speed x{}'.format(len(ifnames)), lambda: [
+            ethtool.get_speed(ifname) for ifname in ifnames]),
+        ('ethtool.read_speed x{}'.format(len(ifnames)), lambda: [
+            ethtool.read_speed(ifname, root) for ifname in ifnames]),
+        ('dmidecode.parse_dmi', lambda: dmidecode.parse_dmi(dump)),
+        ('smbios.decode', lambda: smbios.decode(entry_point, table)),
+        ('netlink decode {} links'.format(len(link_msgs)), lambda:
+            decode_tables(link_msgs, addr_msgs)),
+        ('get_phy_int/get_vid all links', lambda: phy_ints(links)),
+        ('ifaddresses all links', lambda: ifaddresses(addrs)),
+        ('snapshot.collect_addresses', lambda:
+            snapshot.collect_addresses(snap_links, addrs)),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nics', type=int, default=256)
+    parser.add_argument('--nvmes', type=int, default=32)
+    parser.add_argument('--cpus', type=int, default=128)
+    parser.add_argument('--processors', type=int, default=8)
+    parser.add_argument('--dimms', type=int, default=96)
+    parser.add_argument('--veths', type=int, default=2000)
+    parser.add_argument('--vlans', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench-sysfs-')
+    try:
+        print('{0:<36} {1:>10} {2:>10}'.format('step', 'best (ms)',
+            'mean (ms)'))
+        for name, func in run(args, root):
+            best, mean = timed(args.repeat, func)
+            print('{0:<36} {1:>10.2f} {2:>10.2f}'.format(name, best * 1e3,
+                mean * 1e3))
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,137 @@
+"""
+API cost of NetBoxAgent syncs against the fake NetBox in fake_netbox.py.
+
+For every size, runs a first sync of a synthetic host, a resync with
+nothing changed, and a churn sync after every address and a tenth of the
+interfaces changed, and reports the requests per endpoint, response bytes,
+wall time and peak Python memory of each.
+
+    python3 bench/bench_sync.py [--sizes 10,100,1000] [--latency 0.002]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import json_codec
+import netbox_agent
+import snapshot
+
+import fake_netbox
+import fixtures
+
+CONFIG = """[DEFAULT]
+api_base_url = {0}
+token = 0123456789abcdef0123456789abcdef01234567
+sitename = bench
+rack_name = bench_rack
+device_role = DTN
+device_role_color = aa1409
+
+[Optional]
+rack_group = bench_group
+compress_requests = {1}
+json_codec = {2}
+"""
+
+
+def write_config(directory, api_url, use_gzip=False, codec='json'):
+    path = os.path.join(directory, 'bench.cfg')
+    with open(path, 'w') as config:
+        config.write(CONFIG.format(api_url, 'yes' if use_gzip else 'no',
+            codec))
+    return path
+
+
+def sync(config, snap):
+    """Sync snap and return the response bytes the agent received."""
+    agent = netbox_agent.NetBoxAgent(config, snapshot.SnapshotHost(snap))
+    try:
+        agent.update_interfaces()
+        agent.update_pci()
+    finally:
+        agent.close()
+    return sum(n for (_, _, direction), n in agent.metrics.bytes.items()
+        if direction == 'received')
+
+
+def measure(name, netbox, config, snap):
+    netbox.store.requests.clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    received = sync(config, snap)
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests = Counter(netbox.store.requests)
+    return {'scenario' : name, 'requests' : sum(requests.values()),
+        'writes' : sum(n for (method, _), n in requests.items()
+        if method != 'GET'), 'received' : received, 'wall' : wall,
+        'peak' : peak,
+        'endpoints' : {'{0} {1}'.format(*k) : n
+        for k, n in sorted(requests.items())}}
+
+
+def run(sizes, latency, vlans, use_gzip=False, codec='json'):
+    results = []
+    for size in sizes:
+        with fake_netbox.FakeNetBox(latency, use_gzip) as netbox, \
+            tempfile.TemporaryDirectory() as directory:
+            config = write_config(directory, netbox.api_url, use_gzip, codec)
+            host = fixtures.host_snapshot('bench-host', size, vlans)
+            results.append(measure('first sync {}'.format(size), netbox,
+                config, host))
+            results.append(measure('resync {}'.format(size), netbox, config,
+                host))
+            churned = fixtures.host_snapshot('bench-host', size, vlans,
+                generation=1)
+            results.append(measure('churn {}'.format(size), netbox, config,
+                churned))
+    return results
+
+
+def report(results):
+    print('{0:<18} {1:>8} {2:>7} {3:>9} {4:>9} {5:>10}'.format('scenario',
+        'requests', 'writes', 'recv (KB)', 'wall (s)', 'peak (MB)'))
+    for r in results:
+        print('{0:<18} {1:>8} {2:>7} {3:>9.1f} {4:>9.3f} {5:>10.1f}'.format(
+            r['scenario'], r['requests'], r['writes'], r['received'] / 1e3,
+            r['wall'], r['peak'] / 1e6))
+    for r in results:
+        print('\n' + r['scenario'])
+        for endpoint, n in r['endpoints'].items():
+            print('  {0:<32} {1:>6}'.format(endpoint, n))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+        help='comma separated interface counts')
+    parser.add_argument('--latency', type=float, default=0,
+        help='seconds added to every request')
+    parser.add_argument('--vlans', type=int, default=2,
+        help='VLAN interfaces on each host')
+    parser.add_argument('--gzip', action='store_true',
+        help='compress responses and requests')
+    parser.add_argument('--codec', default='json',
+        choices=json_codec.CODECS, help='JSON codec of the agent')
+    parser.add_argument('--json', action='store_true',
+        help='print the results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run([int(n) for n in args.sizes.split(',')], args.latency,
+        args.vlans, args.gzip, args.codec)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
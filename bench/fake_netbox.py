@@ -0,0 +1,252 @@
+"""
+In-process stand-in for the parts of the NetBox REST API the agent uses:
+list/detail/bulk endpoints with filtering and limit/offset pagination.
+Every request is counted per (method, endpoint).
+"""
+import gzip
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlparse, parse_qs
+
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+
+# Fields returned as nested objects
+NESTED_FIELDS = ('site', 'group', 'rack', 'device_role', 'manufacturer',
+    'device_type', 'device', 'interface', 'vlan', 'untagged_vlan',
+    'primary_ip4', 'primary_ip6')
+
+# Query parameters filtering on a related object's ID
+ID_FILTERS = {'site_id' : 'site', 'group_id' : 'group', 'device_id' : 'device',
+    'interface_id' : 'interface', 'device_type_id' : 'device_type'}
+
+IGNORED_PARAMS = ('limit', 'offset', 'brief', 'fields')
+
+# Fields kept in brief mode
+BRIEF_FIELDS = ('id', 'url', 'display', 'name', 'slug', 'model', 'vid',
+    'prefix', 'address', 'family')
+
+URL = re.compile(r'^/api/(\w+/[\w-]+)/(?:(\d+)/)?$')
+
+
+class Store():
+    def __init__(self):
+        self.objects = {}
+        self.last_id = 0
+        self.requests = Counter()
+        self.lock = threading.RLock()
+
+    def endpoint(self, obj_name):
+        return self.objects.setdefault(obj_name, {})
+
+    def nest(self, data):
+        for field in NESTED_FIELDS:
+            if type(data.get(field)) == int:
+                data[field] = {'id' : data[field]}
+        return data
+
+    def create(self, obj_name, data):
+        self.last_id += 1
+        obj = self.nest(dict(data, id=self.last_id))
+        if obj_name == 'ipam/ip-addresses':
+            obj['family'] = {'value' : 6 if ':' in obj['address'] else 4}
+            iface = self.endpoint('dcim/interfaces').get(
+                obj['interface']['id'])
+            if iface == None:
+                raise KeyError('interface {}'.format(obj['interface']['id']))
+            obj['device'] = iface['device']
+        self.endpoint(obj_name)[obj['id']] = obj
+        return obj
+
+    def update(self, obj_name, id, data):
+        obj = self.endpoint(obj_name)[id]
+        obj.update(self.nest(dict(data)))
+        obj['id'] = id
+        return obj
+
+    def delete(self, obj_name, id):
+        del self.endpoint(obj_name)[id]
+
+    def matches(self, obj, key, value):
+        if key in ID_FILTERS:
+            related = obj.get(ID_FILTERS[key])
+            return related != None and str(related['id']) == value
+        elif key == 'q':
+            return any(value in str(v) for v in obj.values())
+        field = obj.get(key)
+        if type(field) == dict:
+            field = field.get('id', field.get('value'))
+        return str(field) == value
+
+    def search(self, obj_name, params):
+        results = list(self.endpoint(obj_name).values())
+        for key, values in params.items():
+            if key not in IGNORED_PARAMS:
+                results = [o for o in results if self.matches(o, key,
+                    values[0])]
+        return results
+
+    def shape(self, obj, params):
+        """obj as returned with the brief or fields parameters."""
+        if 'fields' in params:
+            keep = params['fields'][0].split(',')
+        elif params.get('brief', [''])[0].lower() in ('1', 'true'):
+            keep = BRIEF_FIELDS
+        else:
+            return obj
+        return {k : v for k, v in obj.items() if k in keep}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't let Nagle delay them
+    disable_nagle_algorithm = True
+    store = None
+    latency = 0
+    # Compress responses and accept compressed requests, like a proxy with
+    # gzip enabled in front of NetBox
+    gzip = False
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.gzip and data and 'gzip' in self.headers.get(
+            'Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def parse(self, method):
+        """
+        (obj_name, id, query parameters, body) of the request, or Nones
+        once an error response has been sent.
+        """
+        url = urlparse(self.path)
+        match = URL.match(url.path)
+        if match == None:
+            self.send(404, {'detail' : 'Not found.'})
+            return None, None, None, None
+        obj_name = match.group(1)
+        id = int(match.group(2)) if match.group(2) else None
+
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not self.gzip:
+                self.send(400, {'detail' : 'JSON parse error'})
+                return None, None, None, None
+            data = gzip.decompress(data)
+        body = json.loads(data) if length else None
+
+        self.store.requests[(method, obj_name)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return obj_name, id, parse_qs(url.query), body
+
+    def do_GET(self):
+        obj_name, id, params, _ = self.parse('GET')
+        if obj_name == None:
+            return
+
+        with self.store.lock:
+            if id != None:
+                obj = self.store.endpoint(obj_name).get(id)
+                if obj == None:
+                    return self.send(404, {'detail' : 'Not found.'})
+                return self.send(200, self.store.shape(obj, params))
+            results = [self.store.shape(obj, params) for obj in
+                self.store.search(obj_name, params)]
+
+        limit = int(params.get('limit', [DEFAULT_PAGE_SIZE])[0])
+        limit = MAX_PAGE_SIZE if limit == 0 else min(limit, MAX_PAGE_SIZE)
+        offset = int(params.get('offset', [0])[0])
+        next_url = None
+        if offset + limit < len(results):
+            query = {k : v[0] for k, v in params.items()}
+            query.update(limit=limit, offset=offset + limit)
+            next_url = 'http://{0}/api/{1}/?{2}'.format(self.headers['Host'],
+                obj_name, urlencode(query))
+        self.send(200, {'count' : len(results), 'next' : next_url,
+            'previous' : None, 'results' : results[offset:offset + limit]})
+
+    def do_POST(self):
+        obj_name, _, _, body = self.parse('POST')
+        if obj_name == None:
+            return
+        with self.store.lock:
+            try:
+                if type(body) == list:
+                    return self.send(201, [self.store.create(obj_name, data)
+                        for data in body])
+                return self.send(201, self.store.create(obj_name, body))
+            except KeyError as e:
+                return self.send(400, {'detail' : 'Unknown {}'.format(e)})
+
+    def do_PATCH(self):
+        obj_name, id, _, body = self.parse('PATCH')
+        if obj_name == None:
+            return
+        with self.store.lock:
+            try:
+                if type(body) == list:
+                    return self.send(200, [self.store.update(obj_name,
+                        data['id'], data) for data in body])
+                return self.send(200, self.store.update(obj_name, id, body))
+            except KeyError:
+                return self.send(404, {'detail' : 'Not found.'})
+
+    def do_DELETE(self):
+        obj_name, id, _, body = self.parse('DELETE')
+        if obj_name == None:
+            return
+        ids = [data['id'] for data in body] if type(body) == list else [id]
+        with self.store.lock:
+            if any(i not in self.store.endpoint(obj_name) for i in ids):
+                return self.send(404, {'detail' : 'Not found.'})
+            for i in ids:
+                self.store.delete(obj_name, i)
+        self.send(204)
+
+
+class FakeNetBox():
+    """
+    Serves a fresh Store on a free localhost port from a background
+    thread. latency is added to every request, in seconds. With
+    use_gzip, responses are gzipped and gzipped requests accepted.
+    """
+    def __init__(self, latency=0, use_gzip=False):
+        self.store = Store()
+        handler = type('BoundHandler', (Handler,), {'store' : self.store,
+            'latency' : latency, 'gzip' : use_gzip})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+            daemon=True)
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:{}/api'.format(self.server.server_port)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
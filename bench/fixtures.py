@@ -0,0 +1,353 @@
+"""
+Generators for synthetic hosts, so syncs of any size can be run without
+the hardware behind them, and for the raw inputs of each discovery step
+(lshw and ethtool output, dmidecode dumps, SMBIOS tables, sysfs trees,
+netlink dumps).
+"""
+import json
+import os
+import struct
+
+import snapshot
+
+DMI = [
+    ['system', {'_title' : 'System Information', 'Manufacturer' : 'Dell Inc.',
+        'Product Name' : 'PowerEdge R740', 'Serial Number' : 'ABC1234'}],
+    ['chassis', {'_title' : 'Chassis Information', 'Height' : '2 U'}],
+]
+
+
+def host_snapshot(hostname, interfaces, vlans=0, generation=0):
+    """
+    Snapshot of a host with the given number of physical interfaces
+    (eth0...), each with one IPv4 and one IPv6 address, and vlans VLAN
+    interfaces on eth0. Hosts of different generations have different
+    addresses on every interface, and every tenth interface replaced by a
+    new one.
+    """
+    links, addresses, formfactors = [], [], {}
+    for i in range(interfaces):
+        name = 'eth{}'.format(i)
+        if generation > 0 and i % 10 == 9:
+            name = 'ens{0}g{1}'.format(i, generation)
+        index = i + 1
+        links.append([index, name, None, None, None, None,
+            '02:00:00:{0:02x}:{1:02x}:{2:02x}'.format(generation, i >> 8,
+            i & 0xff)])
+        addresses.append([index, 'inet', '10.{0}.{1}.{2}'.format(generation,
+            (i >> 8) + 1, i & 0xff), 16])
+        addresses.append([index, 'inet6', 'fd00:{0:x}::{1:x}'.format(
+            generation, i + 1), 64])
+        formfactors[name] = 1000
+
+    for vid in range(1, vlans + 1):
+        index = interfaces + vid
+        links.append([index, 'eth0.{}'.format(vid), 'vlan', 1, None, vid,
+            links[0][6]])
+        addresses.append([index, 'inet', '172.{0}.{1}.2'.format(16 + vid // 256,
+            vid % 256), 24])
+
+    hw = [{'bus info' : 'cpu@0', 'class' : 'cpu', 'product' : 'Xeon Gold',
+        'description' : 'Central Processing Unit'}]
+    for i in range(0, interfaces, 2):
+        hw.append({'bus info' : 'pci@0000:{0:02x}:00.0'.format(i // 2 + 1),
+            'class' : 'network', 'description' : 'Ethernet interface',
+            'vendor' : 'Intel Corporation', 'product' : 'Ethernet X710'})
+
+    return {'version' : snapshot.SNAPSHOT_VERSION, 'hostname' : hostname,
+        'system' : 'Linux', 'dmi' : DMI, 'links' : links,
+        'addresses' : addresses, 'gateways' : [['inet',
+        '10.{}.0.254'.format(generation), 'eth0']]
+        if interfaces > 0 else [], 'formfactors' : formfactors, 'hw' : hw}
+
+
+NIC = ('Intel Corporation', 0x8086, 0x1572,
+    'Ethernet Controller X710 for 10GbE SFP+')
+NVME = ('Samsung Electronics Co Ltd', 0x144d, 0xa808,
+    'NVMe SSD Controller SM981/PM981/PM983')
+
+
+def pci_addr(i):
+    return '0000:{0:02x}:{1:02x}.{2}'.format(i // 32 + 1, i % 32 // 8, i % 8)
+
+
+def lshw_nodes(nics, nvmes=0):
+    """
+    lshw nodes of nics network functions, nvmes NVMe controllers and two
+    CPUs, as a flat list of (class, dict of lshw text properties).
+    """
+    nodes = [('cpu', {'description' : 'CPU', 'product' :
+        'Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz', 'vendor' : 'Intel Corp.',
+        'bus info' : 'cpu@{}'.format(cpu), 'size' : '2100MHz'})
+        for cpu in range(2)]
+    for i in range(nics):
+        nodes.append(('network', {'description' : 'Ethernet interface',
+            'product' : NIC[3], 'vendor' : NIC[0], 'physical id' : '0',
+            'bus info' : 'pci@' + pci_addr(i), 'logical name' :
+            'ens{}f0'.format(i), 'version' : '02', 'serial' :
+            '3c:fd:fe:00:{0:02x}:{1:02x}'.format(i >> 8, i & 0xff),
+            'capacity' : '10Gbit/s', 'width' : '64 bits',
+            'configuration' : 'autonegotiation=off broadcast=yes '
+            'driver=i40e driverversion=2.8.20-k firmware=6.80 link=yes',
+            'resources' : 'irq:35 memory:ac000000-acffffff'}))
+    for i in range(nics, nics + nvmes):
+        nodes.append(('storage', {'description' : 'NVMe device',
+            'product' : NVME[3], 'vendor' : NVME[0],
+            'bus info' : 'pci@' + pci_addr(i), 'logical name' :
+            '/dev/nvme{}'.format(i - nics), 'version' : '00',
+            'width' : '64 bits', 'configuration' : 'driver=nvme latency=0',
+            'resources' : 'irq:40 memory:b0000000-b0003fff'}))
+    return nodes
+
+
+def lshw_text(nodes):
+    """lshw -class output for nodes."""
+    lines = ['host']
+    for cls, props in nodes:
+        lines.append('  *-{}'.format(cls))
+        lines.extend('       {0}: {1}'.format(k, v) for k, v in props.items())
+    return '\n'.join(lines) + '\n'
+
+
+def lshw_json(nodes):
+    """lshw -json output for nodes, as the array newer versions print."""
+    objs = []
+    for i, (cls, props) in enumerate(nodes):
+        obj = {'id' : cls, 'class' : cls, 'claimed' : True,
+            'handle' : 'PCI:{}'.format(props['bus info'][4:]),
+            'businfo' : props['bus info'], 'description' :
+            props['description'], 'product' : props['product'],
+            'vendor' : props['vendor'], 'configuration' : dict(
+            kv.split('=', 1) for kv in props.get('configuration',
+            '').split())}
+        if 'logical name' in props:
+            obj['logicalname'] = props['logical name']
+        objs.append(obj)
+    return json.dumps(objs, indent=2)
+
+
+ETHTOOL = """Settings for {0}:
+\tSupported ports: [ FIBRE ]
+\tSupported link modes:   10000baseSR/Full
+\tSupported pause frame use: Symmetric
+\tSupports auto-negotiation: No
+\tAdvertised link modes:  10000baseSR/Full
+\tAdvertised pause frame use: No
+\tAdvertised auto-negotiation: No
+\tSpeed: {1}Mb/s
+\tDuplex: Full
+\tPort: FIBRE
+\tPHYAD: 0
+\tTransceiver: internal
+\tAuto-negotiation: off
+\tSupports Wake-on: d
+\tWake-on: d
+\tCurrent message level: 0x00000007 (7)
+\t\t\t       drv probe link
+\tLink detected: yes
+"""
+
+
+def ethtool_output(ifname, speed=10000):
+    return ETHTOOL.format(ifname, speed)
+
+
+def dmidecode_dump(processors, dimms):
+    """dmidecode output with processors sockets and dimms DIMMs."""
+    sections = ["""Handle 0x0000, DMI type 0, 26 bytes
+BIOS Information
+\tVendor: Dell Inc.
+\tVersion: 2.12.2
+\tRelease Date: 07/09/2021
+\tCharacteristics:
+\t\tPCI is supported
+\t\tPNP is supported
+\t\tBIOS is upgradeable""", """Handle 0x0100, DMI type 1, 27 bytes
+System Information
+\tManufacturer: Dell Inc.
+\tProduct Name: PowerEdge R740
+\tVersion: Not Specified
+\tSerial Number: ABC1234
+\tUUID: 4c4c4544-0042-3110-8043-b2c04f503432
+\tSKU Number: SKU=NotProvided;ModelName=PowerEdge R740
+\tFamily: PowerEdge""", """Handle 0x0300, DMI type 3, 22 bytes
+Chassis Information
+\tManufacturer: Dell Inc.
+\tType: Rack Mount Chassis
+\tVersion: Not Specified
+\tSerial Number: ABC1234
+\tAsset Tag: Not Specified
+\tHeight: 2 U"""]
+    for cpu in range(processors):
+        sections.append("""Handle 0x04{0:02X}, DMI type 4, 48 bytes
+Processor Information
+\tSocket Designation: CPU{1}
+\tType: Central Processor
+\tFamily: Xeon
+\tManufacturer: Intel
+\tVersion: Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz
+\tMax Speed: 4000 MHz
+\tCurrent Speed: 2100 MHz
+\tCore Count: 16
+\tThread Count: 32
+\tCharacteristics:
+\t\t64-bit capable
+\t\tMulti-Core
+\t\tHardware Thread""".format(cpu, cpu + 1))
+    for dimm in range(dimms):
+        sections.append("""Handle 0x11{0:02X}, DMI type 17, 84 bytes
+Memory Device
+\tArray Handle: 0x1000
+\tTotal Width: 72 bits
+\tData Width: 64 bits
+\tSize: 32 GB
+\tForm Factor: DIMM
+\tLocator: {1}{2}
+\tBank Locator: Not Specified
+\tType: DDR4
+\tSpeed: 2666 MT/s
+\tManufacturer: 00AD00B300AD
+\tSerial Number: {0:08X}
+\tPart Number: HMA84GR7CJR4N-VK""".format(dimm, 'ABCD'[dimm % 4],
+            dimm // 4 + 1))
+    return ('# dmidecode 3.2\nGetting SMBIOS data from sysfs.\n'
+        'SMBIOS 3.2.0 present.\n\n' + '\n\n'.join(sections) + '\n\n'
+        'Handle 0x7F00, DMI type 127, 4 bytes\nEnd Of Table\n')
+
+
+def smbios_structure(typ, handle, length, fields, strings):
+    """
+    One SMBIOS structure. fields maps offsets to (struct format, value);
+    string fields hold 1-based indexes into strings.
+    """
+    data = bytearray(length)
+    struct.pack_into('<BBH', data, 0, typ, length, handle)
+    for offset, (fmt, value) in fields.items():
+        struct.pack_into('<' + fmt, data, offset, value)
+    text = b''.join(s.encode('ascii') + b'\0' for s in strings)
+    return bytes(data) + (text or b'\0') + b'\0'
+
+
+def smbios_tables(processors, dimms):
+    """
+    (entry point, table) of SMBIOS 3.2 tables describing the same machine
+    as dmidecode_dump.
+    """
+    table = [smbios_structure(0, 0x0000, 0x18, {4 : ('B', 1), 5 : ('B', 2),
+        8 : ('B', 3)}, ['Dell Inc.', '2.12.2', '07/09/2021']),
+        smbios_structure(1, 0x0100, 0x1B, {4 : ('B', 1), 5 : ('B', 2),
+        6 : ('B', 0), 7 : ('B', 3),
+        8 : ('16s', bytes.fromhex('44454c4c420010318043b2c04f503432')),
+        0x19 : ('B', 4), 0x1A : ('B', 5)}, ['Dell Inc.', 'PowerEdge R740',
+        'ABC1234', 'SKU=NotProvided;ModelName=PowerEdge R740', 'PowerEdge']),
+        smbios_structure(3, 0x0300, 0x16, {4 : ('B', 1), 5 : ('B', 0x17),
+        7 : ('B', 2), 0x11 : ('B', 2)}, ['Dell Inc.', 'ABC1234'])]
+    for cpu in range(processors):
+        table.append(smbios_structure(4, 0x0400 + cpu, 0x30, {4 : ('B', 1),
+            6 : ('B', 0xB3), 7 : ('B', 2), 0x10 : ('B', 3),
+            0x14 : ('H', 4000), 0x23 : ('B', 16), 0x25 : ('B', 32),
+            0x28 : ('H', 0xB3), 0x2A : ('H', 16), 0x2E : ('H', 32)},
+            ['CPU{}'.format(cpu + 1), 'Intel',
+            'Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz']))
+    for dimm in range(dimms):
+        table.append(smbios_structure(17, 0x1100 + dimm, 0x28,
+            {0x0C : ('H', 0x7FFF), 0x10 : ('B', 1), 0x11 : ('B', 2),
+            0x17 : ('B', 3), 0x18 : ('B', 4), 0x1A : ('B', 5),
+            0x1C : ('I', 32768)}, ['{0}{1}'.format('ABCD'[dimm % 4],
+            dimm // 4 + 1), 'Not Specified', '00AD00B300AD',
+            '{:08X}'.format(dimm), 'HMA84GR7CJR4N-VK']))
+    table.append(smbios_structure(127, 0x7F00, 4, {}, []))
+    table = b''.join(table)
+
+    entry_point = struct.pack('<5sBBBBBBBIQ', b'_SM3_', 0, 0x18, 3, 2, 0, 1,
+        0, len(table), 0)
+    return entry_point, table
+
+
+def sysfs_tree(root, nics, nvmes=0, cpus=64):
+    """
+    Write a sysfs/procfs tree with nics network and nvmes NVMe PCI
+    functions and cpus logical CPUs on two sockets under root.
+    """
+    def write(path, value):
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(value + '\n')
+
+    write('usr/share/hwdata/pci.ids', '\n'.join([
+        '{0:04x}  {1}'.format(NIC[1], NIC[0]),
+        '\t{0:04x}  {1}'.format(NIC[2], NIC[3]),
+        '{0:04x}  {1}'.format(NVME[1], NVME[0]),
+        '\t{0:04x}  {1}'.format(NVME[2], NVME[3]),
+        'C 01  Mass storage controller', '\t08  Non-Volatile memory controller',
+        'C 02  Network controller', '\t00  Ethernet controller']))
+
+    for i in range(nics + nvmes):
+        dev = os.path.join('sys/bus/pci/devices', pci_addr(i))
+        vendor = NIC if i < nics else NVME
+        write(os.path.join(dev, 'class'), '0x020000' if i < nics
+            else '0x010802')
+        write(os.path.join(dev, 'vendor'), '0x{:04x}'.format(vendor[1]))
+        write(os.path.join(dev, 'device'), '0x{:04x}'.format(vendor[2]))
+        if i < nics:
+            ifname = 'ens{}f0'.format(i)
+            os.makedirs(os.path.join(root, dev, 'net', ifname))
+            write(os.path.join('sys/class/net', ifname, 'speed'), '10000')
+        else:
+            ctrl = os.path.join(root, 'sys/class/nvme/nvme{}'.format(
+                i - nics))
+            write(os.path.join(ctrl, 'model'), 'SAMSUNG MZ1LB960HAJQ-00007')
+            os.symlink(os.path.join(root, dev), os.path.join(ctrl, 'device'))
+
+    write('proc/cpuinfo', '\n\n'.join('processor\t: {0}\nvendor_id\t: '
+        'GenuineIntel\nmodel name\t: Intel(R) Xeon(R) Gold 6130 CPU @ '
+        '2.10GHz\nphysical id\t: {1}\ncore id\t\t: {2}\ncpu cores\t: '
+        '{3}'.format(cpu, cpu * 2 // cpus, cpu % (cpus // 2), cpus // 2)
+        for cpu in range(cpus)))
+
+
+def netlink_dump(veths, vlans):
+    """
+    Raw RTM_NEWLINK and RTM_NEWADDR messages (lists of bytes) of a host
+    with two physical NICs, veths veth pairs whose peers are in other
+    namespaces, and vlans VLANs on the first NIC, each with an address.
+    """
+    from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg
+    from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+
+    def link(index, name, attrs=()):
+        msg = ifinfmsg()
+        msg['index'] = index
+        msg['attrs'] = [['IFLA_IFNAME', name], ['IFLA_ADDRESS',
+            '02:00:{0:02x}:{1:02x}:{2:02x}:{3:02x}'.format(index >> 24,
+            index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff)]] + list(attrs)
+        msg.encode()
+        return msg.data
+
+    def addr(index, family, address, prefixlen):
+        msg = ifaddrmsg()
+        msg['index'] = index
+        msg['family'] = family
+        msg['prefixlen'] = prefixlen
+        msg['attrs'] = [['IFA_ADDRESS', address], ['IFA_LOCAL', address]]
+        msg.encode()
+        return msg.data
+
+    links = [link(1, 'lo'), link(2, 'eno1'), link(3, 'eno2')]
+    addrs = [addr(1, 2, '127.0.0.1', 8), addr(2, 2, '192.0.2.10', 24),
+        addr(2, 10, 'fd00::10', 64)]
+    for i in range(vlans):
+        index = 4 + i
+        links.append(link(index, 'eno1.{}'.format(i + 1), [['IFLA_LINK', 2],
+            ['IFLA_LINKINFO', {'attrs' : [['IFLA_INFO_KIND', 'vlan'],
+            ['IFLA_INFO_DATA', {'attrs' : [['IFLA_VLAN_ID', i + 1]]}]]}]]))
+        addrs.append(addr(index, 2, '10.{0}.{1}.1'.format((i + 1) >> 8,
+            (i + 1) & 0xff), 24))
+    for i in range(veths):
+        index = 4 + vlans + i
+        links.append(link(index, 'veth{:x}'.format(i), [['IFLA_LINK', i + 1],
+            ['IFLA_LINK_NETNSID', i],
+            ['IFLA_LINKINFO', {'attrs' : [['IFLA_INFO_KIND', 'veth']]}]]))
+        addrs.append(addr(index, 10, 'fe80::{:x}'.format(index), 64))
+    return links, addrs
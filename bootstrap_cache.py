@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import time
+
+DEFAULT_TTL = 86400
+
+
+def cache_path(configFile):
+    return os.path.splitext(configFile)[0] + '.cache'
+
+
+class BootstrapCache():
+    """
+    On-disk cache of the NetBox object IDs resolved while bootstrapping the
+    agent (site, rack, device role, device type, device...).
+
+    Entries are keyed by the configuration values and hostname they were
+    resolved from, so any change to either invalidates the cache, and they
+    expire after ttl seconds.
+    """
+    def __init__(self, path, key, ttl=DEFAULT_TTL):
+        self.path = path
+        self.key = key
+        self.ttl = ttl
+
+    def load(self):
+        if self.ttl <= 0 or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring unreadable cache {0}: {1}'.format(
+                self.path, e))
+            return None
+
+        if entry.get('key') != self.key:
+            logging.debug('Bootstrap cache is for another configuration')
+            return None
+        if time.time() - entry.get('time', 0) > self.ttl:
+            logging.debug('Bootstrap cache expired')
+            return None
+        return entry['ids']
+
+    def save(self, ids):
+        entry = {'key' : self.key, 'time' : time.time(), 'ids' : ids}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning('Failed to write cache {0}: {1}'.format(
+                self.path, e))
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning('Failed to remove cache {0}: {1}'.format(
+                self.path, e))
@@ -0,0 +1,182 @@
+import asyncio
+import functools
+import logging
+import threading
+from collections import OrderedDict
+
+import timing
+
+DEFAULT_CHUNK_SIZE = 100
+
+EXPECTED_STATUS = {'POST' : 201, 'PATCH' : 200, 'DELETE' : 204}
+
+
+class BulkWriteError(Exception):
+    """
+    Raised by BulkWriter.flush when some queued writes were rejected.
+    errors is a list of (source, method, obj_name, detail) tuples.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('{0} bulk write(s) failed: {1}'.format(len(errors),
+            '; '.join('{1} {2} {0}: {3}'.format(*e) for e in errors)))
+
+
+def run_callbacks(callbacks, result):
+    for callback in callbacks:
+        callback(result)
+
+
+class BulkWriter():
+    """
+    Collects create/update/delete operations per NetBox endpoint and sends
+    them as list requests of at most chunk_size objects.
+
+    Every operation carries a source label (interface name, address, bus
+    address...) used to report per-item errors, and an optional callback
+    that receives the resulting object. Callbacks may queue further
+    operations; they are sent in the next round of the same flush, so an
+    object is always written after the one it depends on.
+
+    Updates are coalesced: all the fields queued for one object are merged
+    into a single PATCH, sent once nothing else is pending in the flush
+    (so after any object the update refers to has been created). The
+    callbacks of every merged update then receive the patched object.
+
+    The requests of one round are independent of each other: with an
+    aclient (netbox_client.AsyncNetBoxClient) they are sent concurrently,
+    deletions first, and callbacks run on its thread pool.
+
+    If plan (a planner.Plan) is given, operations are recorded in it
+    instead of being sent.
+    """
+    def __init__(self, client, chunk_size=DEFAULT_CHUNK_SIZE, plan=None,
+        aclient=None):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.plan = plan
+        self.aclient = aclient
+        self.pending = OrderedDict()
+        self.updates = OrderedDict()
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def create(self, obj_name, data, source=None, callback=None):
+        self.add('POST', obj_name, data, source, callback)
+
+    def update(self, obj_name, id, data, source=None, callback=None):
+        if source is None:
+            source = data.get('name', id)
+        with self.lock:
+            if (obj_name, id) not in self.updates:
+                self.updates[(obj_name, id)] = ({'id' : id}, source, [])
+            merged, _, callbacks = self.updates[(obj_name, id)]
+            merged.update(data)
+            if callback != None:
+                callbacks.append(callback)
+
+    def delete(self, obj_name, id, source=None, callback=None):
+        self.add('DELETE', obj_name, {'id' : id}, source, callback)
+
+    def add(self, method, obj_name, data, source, callback):
+        if source is None:
+            source = data.get('name', data.get('id'))
+        with self.lock:
+            self.pending.setdefault((method, obj_name), []).append(
+                (data, source, callback))
+
+    @timing.timed('flush writes')
+    def flush(self):
+        try:
+            while self.pending or self.updates:
+                with self.lock:
+                    if self.pending:
+                        pending, self.pending = self.pending, OrderedDict()
+                    else:
+                        pending = self.merged_updates()
+                        self.updates = OrderedDict()
+                chunks = [(method, obj_name, ops[i:i + self.chunk_size])
+                    for (method, obj_name), ops in pending.items()
+                    for i in range(0, len(ops), self.chunk_size)]
+                # Free names and addresses before anything is created
+                self.send_all([c for c in chunks if c[0] == 'DELETE'])
+                self.send_all([c for c in chunks if c[0] != 'DELETE'])
+            errors = self.errors
+        finally:
+            # If a request failed, the writes queued after it depend on
+            # state that may be stale: drop them rather than send them
+            # with the next flush
+            self.reset()
+        if len(errors) > 0:
+            raise BulkWriteError(errors)
+
+    def send_all(self, chunks):
+        if self.aclient == None or self.plan != None or len(chunks) < 2:
+            for chunk in chunks:
+                self.send(*chunk)
+            return
+        # Wait for every request, so none is still running (and queuing
+        # writes from its callbacks) once the first failure is raised
+        results = asyncio.run(self.send_concurrently(chunks))
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def send_concurrently(self, chunks):
+        return await asyncio.gather(*(self.aclient.call(self.send, *chunk)
+            for chunk in chunks), return_exceptions=True)
+
+    def reset(self):
+        """Drop every queued operation and error."""
+        with self.lock:
+            self.pending = OrderedDict()
+            self.updates = OrderedDict()
+            self.errors = []
+
+    def merged_updates(self):
+        pending = OrderedDict()
+        for (obj_name, _), (data, source, callbacks) in self.updates.items():
+            pending.setdefault(('PATCH', obj_name), []).append((data, source,
+                functools.partial(run_callbacks, callbacks)))
+        return pending
+
+    def send(self, method, obj_name, ops):
+        if self.plan != None:
+            for data, source, callback in ops:
+                result = self.plan.add(method, obj_name, data, source)
+                if callback != None: callback(result)
+            return
+
+        logging.debug('Bulk {0} of {1} {2}'.format(method, len(ops),
+            obj_name))
+        resp = self.client.request(method, self.client.url(obj_name),
+            json=[data for data, _, _ in ops], allow_redirects=False)
+
+        if resp.status_code == EXPECTED_STATUS[method]:
+            if method == 'DELETE': results = [None] * len(ops)
+            else: results = self.client.decode(resp)
+            for (_, _, callback), result in zip(ops, results):
+                if callback != None: callback(result)
+            return
+
+        try:
+            details = self.client.decode(resp)
+        except ValueError:
+            details = None
+        if type(details) != list or len(details) != len(ops):
+            details = [details or resp.reason] * len(ops)
+
+        # NetBox rejects the whole list if any item is invalid. Retry the
+        # items that were not at fault on their own.
+        valid = [op for op, detail in zip(ops, details) if not detail]
+        if len(valid) == len(ops):
+            # No item is at fault, so none would ever be sent
+            details = [resp.text or resp.reason] * len(ops)
+        for (_, source, _), detail in zip(ops, details):
+            if detail:
+                logging.error('Failed to {0} {1} {2} : status {3}: {4}'
+                    ''.format(method, obj_name, source, resp.status_code,
+                    detail))
+                self.errors.append((source, method, obj_name, detail))
+        if 0 < len(valid) < len(ops):
+            self.send(method, obj_name, valid)
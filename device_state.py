@@ -0,0 +1,64 @@
+class DeviceState():
+    """
+    The interfaces, IP addresses and inventory items NetBox holds for one
+    device, fetched once per sync and indexed for diffing.
+
+    Interfaces are indexed by name, addresses by interface id, inventory
+    items by asset tag. The indexes are kept up to date as the agent creates
+    and deletes objects.
+    """
+    def __init__(self, interfaces=(), addresses=(), inventory=()):
+        self.interfaces_by_name = {}
+        self.addresses_by_interface = {}
+        self.inventory_by_tag = {}
+
+        for iface in interfaces:
+            self.add_interface(iface)
+        for addr in addresses:
+            self.add_address(addr)
+        for item in inventory:
+            self.add_inventory(item)
+
+    @staticmethod
+    def address_key(addr):
+        return addr['address'].split('/')[0]
+
+    @staticmethod
+    def interface_id(addr):
+        if addr.get('interface') != None:
+            return addr['interface']['id']
+        return addr.get('assigned_object_id')
+
+    def interfaces(self):
+        return list(self.interfaces_by_name.values())
+
+    def interface(self, name):
+        return self.interfaces_by_name.get(name)
+
+    def addresses(self, interface_id):
+        return list(self.addresses_by_interface.get(interface_id, {}).values())
+
+    def inventory(self):
+        return list(self.inventory_by_tag.values())
+
+    def add_interface(self, iface):
+        self.interfaces_by_name[iface['name']] = iface
+
+    def remove_interface(self, iface):
+        self.interfaces_by_name.pop(iface['name'], None)
+        for addr in self.addresses(iface['id']):
+            self.remove_address(addr)
+
+    def add_address(self, addr):
+        self.addresses_by_interface.setdefault(self.interface_id(addr), {})[
+            addr['id']] = addr
+
+    def remove_address(self, addr):
+        self.addresses_by_interface.get(self.interface_id(addr), {}).pop(
+            addr['id'], None)
+
+    def add_inventory(self, item):
+        self.inventory_by_tag[item['asset_tag']] = item
+
+    def remove_inventory(self, item):
+        self.inventory_by_tag.pop(item['asset_tag'], None)
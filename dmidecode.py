@@ -3,7 +3,9 @@
 # http://pleasedonttouchthescreen.blogspot.com/2012/05/dmidecode-211-for-windows.html
 
 from __future__ import print_function
-import os, sys, platform, urllib
+import os, sys, platform, urllib, json
+
+import timing
 
 __version__ = "0.9.0"
 
@@ -30,6 +32,33 @@ TYPE = {
     41: 'onboard device',
     }
 
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+
+class DMIProfile(object):
+    """
+    DMI structures indexed by type name. Iterating over a profile yields the
+    same (type, value dict) tuples as parse_dmi.
+    """
+    def __init__(self, info):
+        self.info = list(info)
+        self.types = {}
+        for typ, data in self.info:
+            self.types.setdefault(typ, []).append(data)
+
+    def get(self, typ):
+        return self.types.get(typ, [])
+
+    def first(self, typ):
+        items = self.get(typ)
+        return items[0] if items else None
+
+    def __iter__(self):
+        return iter(self.info)
+
+    def __len__(self):
+        return len(self.info)
+
 
 def parse_dmi(content):
     """
@@ -82,17 +111,81 @@ def _parse_handle_section(lines):
     return data
 
 
-def profile():
-    if os.isatty(sys.stdin.fileno()):
-        content = _get_output()
-    else:
-        content = sys.stdin.read()
+def profile(show=False, cache_file=None):
+    """
+    Collect the DMI profile of this machine.
+    DMI data cannot change without a reboot, so if cache_file is given the
+    profile is stored there and reused for as long as the boot id matches.
+    """
+    boot_id = _get_boot_id()
+    info = _load_cache(cache_file, boot_id)
+    if info is None:
+        info = _get_tables()
+        if info is None:
+            if os.isatty(sys.stdin.fileno()):
+                content = _get_output()
+            else:
+                content = sys.stdin.read()
+            info = parse_dmi(content)
+        _save_cache(cache_file, boot_id, info)
 
-    info = parse_dmi(content)
-    _show(info)
+    info = DMIProfile(info)
+    if show:
+        _show(info)
     return info
 
 
+def _get_boot_id():
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _load_cache(cache_file, boot_id):
+    if cache_file is None or boot_id is None:
+        return None
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if cache.get('boot_id') != boot_id:
+        return None
+    return [tuple(item) for item in cache['info']]
+
+
+def _save_cache(cache_file, boot_id, info):
+    if cache_file is None or boot_id is None:
+        return
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump({'boot_id': boot_id, 'info': info}, f)
+    except (IOError, OSError) as e:
+        print('Failed to write DMI cache %s: %s' % (cache_file, e),
+            file=sys.stderr)
+
+
+@timing.timed('read smbios tables')
+def _get_tables():
+    """
+    Decode the SMBIOS tables exported in sysfs, or return None if they are
+    not available so the dmidecode binary is used instead.
+    """
+    if platform.system() != 'Linux':
+        return None
+    import smbios
+    if not smbios.available():
+        return None
+    try:
+        return smbios.read_tables()
+    except (OSError, ValueError) as e:
+        print('Failed to decode SMBIOS tables: %s' % e, file=sys.stderr)
+        return None
+
+
+@timing.timed('run dmidecode')
 def _get_output():
     import subprocess
 
@@ -115,8 +208,9 @@ def _get_output():
 
 
 def _show(info):
-    def _get(i):
-        return [v for j, v in info if j == i]
+    if not isinstance(info, DMIProfile):
+        info = DMIProfile(info)
+    _get = info.get
 
     system = _get('system')[0]
     print ('%s %s (SN: %s, UUID: %s)' % (
@@ -161,4 +255,4 @@ def _show(info):
         ))
 
 if __name__ == '__main__':
-    profile()
+    profile(show=True)
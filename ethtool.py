@@ -1,6 +1,42 @@
+import errno
+import logging
+import os
 import subprocess
 import getpass
+import threading
 
+import timing
+
+try:
+    from pyroute2.netlink import genlmsg, nla, NLA_F_NESTED, NLM_F_REQUEST
+    from pyroute2.netlink.generic import GenericNetlinkSocket
+    from pyroute2.netlink.exceptions import NetlinkError
+except ImportError:
+    GenericNetlinkSocket = None
+    NetlinkError = OSError
+
+# read_form_factor failures after which ethtool -m is run instead
+NETLINK_ERRORS = (NetlinkError, OSError, NotImplementedError)
+
+ETHTOOL_MSG_MODULE_EEPROM_GET = 31
+ETHTOOL_GENL_VERSION = 1
+SFF8079_I2C_ADDRESS_LOW = 0x50
+
+# SFF-8024 identifier values, named as ethtool -m prints them
+SFF8024_IDENTIFIERS = {
+    0x03 : 'SFP',
+    0x0c : 'QSFP',
+    0x0d : 'QSFP+',
+    0x11 : 'QSFP28',
+    0x18 : 'QSFP-DD',
+    0x1e : 'QSFP+ or later with CMIS',
+}
+
+FORMFACTOR_IDS = {'SFP' : 1100, 'QSFP28' : 1600}
+
+formfactor_cache = {}
+
+@timing.timed_command
 def run_command(cmd, ignore_stderr = False):
     proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, 
     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -30,7 +66,7 @@ def run_command(cmd, ignore_stderr = False):
 
 def get_speed(iface):
     out,err = run_command('ethtool ' + iface)
-    if err != None:
+    if err != '':
         if err == 'Cannot get wake-on-lan settings: Operation not permitted\n':
             pass
         else:
@@ -53,22 +89,145 @@ def get_form_factor(iface):
             return formfactor[1:-1]
     raise Exception('Cannot find the formfactor')
 
-def get_formfactor_id(ifname):
-    speed = formfactor = None
+if GenericNetlinkSocket != None:
+    class ethtoolmsg(genlmsg):
+        nla_map = (('ETHTOOL_A_MODULE_EEPROM_UNSPEC', 'none'),
+                   ('ETHTOOL_A_MODULE_EEPROM_HEADER', 'ethtool_header'),
+                   ('ETHTOOL_A_MODULE_EEPROM_OFFSET', 'uint32'),
+                   ('ETHTOOL_A_MODULE_EEPROM_LENGTH', 'uint32'),
+                   ('ETHTOOL_A_MODULE_EEPROM_PAGE', 'uint8'),
+                   ('ETHTOOL_A_MODULE_EEPROM_BANK', 'uint8'),
+                   ('ETHTOOL_A_MODULE_EEPROM_I2C_ADDRESS', 'uint8'),
+                   ('ETHTOOL_A_MODULE_EEPROM_DATA', 'cdata'))
+
+        class ethtool_header(nla):
+            nla_flags = NLA_F_NESTED
+            nla_map = (('ETHTOOL_A_HEADER_UNSPEC', 'none'),
+                       ('ETHTOOL_A_HEADER_DEV_INDEX', 'uint32'),
+                       ('ETHTOOL_A_HEADER_DEV_NAME', 'asciiz'),
+                       ('ETHTOOL_A_HEADER_FLAGS', 'uint32'))
+
+    class EthtoolSocket(GenericNetlinkSocket):
+        """
+        ethtool generic netlink family (Linux 5.13+ for module EEPROM reads)
+        """
+        def __init__(self):
+            GenericNetlinkSocket.__init__(self)
+            try:
+                self.bind('ethtool', ethtoolmsg)
+            except Exception:
+                # No ethtool family before Linux 5.6
+                self.close()
+                raise
 
+        def get_module_identifier(self, ifname):
+            msg = ethtoolmsg()
+            msg['cmd'] = ETHTOOL_MSG_MODULE_EEPROM_GET
+            msg['version'] = ETHTOOL_GENL_VERSION
+            msg['attrs'] = [
+                ['ETHTOOL_A_MODULE_EEPROM_HEADER',
+                    {'attrs' : [['ETHTOOL_A_HEADER_DEV_NAME', ifname]]}],
+                ['ETHTOOL_A_MODULE_EEPROM_OFFSET', 0],
+                ['ETHTOOL_A_MODULE_EEPROM_LENGTH', 1],
+                ['ETHTOOL_A_MODULE_EEPROM_PAGE', 0],
+                ['ETHTOOL_A_MODULE_EEPROM_BANK', 0],
+                ['ETHTOOL_A_MODULE_EEPROM_I2C_ADDRESS',
+                    SFF8079_I2C_ADDRESS_LOW]]
+            # pyroute2 0.5 returns a generator, newer versions a tuple
+            replies = tuple(self.nlm_request(msg, msg_type=self.prid,
+                msg_flags=NLM_F_REQUEST))
+            if len(replies) == 0:
+                return None
+            data = replies[0].get_attr('ETHTOOL_A_MODULE_EEPROM_DATA')
+            return data[0] if data else None
+
+ethtool_socket = None
+# Why module EEPROMs cannot be read over netlink here, once known: the
+# kernel does not change during the process, so it is not retried
+netlink_error = None
+# Interfaces are created, and so probed, from the agent's thread pool;
+# netlink sockets are not thread-safe, so the one socket is created and
+# used under this lock. The ethtool -m fallback runs outside of it.
+ethtool_lock = threading.Lock()
+
+def read_speed(iface, sysfs_root='/'):
+    """
+    Link speed in Mb/s from sysfs, or None if the link is down or the
+    driver does not report it.
+    """
     try:
-        speed = get_speed(ifname)
-        formfactor = get_form_factor(ifname)
-    except Exception:
-        pass
+        with open(os.path.join(sysfs_root, 'sys/class/net', iface,
+            'speed')) as speed_file:
+            speed = int(speed_file.read().strip())
+    except (OSError, ValueError):
+        return None
+    return speed if speed > 0 else None
+
+@timing.timed('netlink module eeprom')
+def read_form_factor(iface):
+    """
+    Module form factor from the first byte of the module EEPROM, read
+    through ethtool netlink. Raises one of NETLINK_ERRORS if netlink cannot
+    be used, returns None if there is no readable module.
+    """
+    global ethtool_socket, netlink_error
+    if GenericNetlinkSocket == None:
+        raise NotImplementedError('pyroute2 generic netlink is not available')
+
+    with ethtool_lock:
+        if netlink_error != None:
+            raise netlink_error
+        if ethtool_socket == None:
+            try:
+                ethtool_socket = EthtoolSocket()
+            except NETLINK_ERRORS as e:
+                netlink_error = e
+                raise
+        try:
+            identifier = ethtool_socket.get_module_identifier(iface)
+        except NetlinkError as e:
+            # Kernels before 5.13 cannot read module EEPROMs over netlink
+            if e.code == errno.EOPNOTSUPP:
+                netlink_error = e
+                raise
+            logging.debug('No module EEPROM for {0}: {1}'.format(iface, e))
+            return None
+    if identifier == None:
+        return None
+    return SFF8024_IDENTIFIERS.get(identifier, '0x{:02x}'.format(identifier))
+
+@timing.timed('ethtool probe')
+def probe(ifname, sysfs_root='/'):
+    speed = read_speed(ifname, sysfs_root)
+    if speed == None:
+        return None, None
 
+    try:
+        formfactor = read_form_factor(ifname)
+    except NETLINK_ERRORS as e:
+        logging.debug('ethtool netlink unavailable ({}), running '
+            'ethtool -m'.format(e))
+        try:
+            formfactor = get_form_factor(ifname)
+        except Exception:
+            formfactor = None
+    return speed, formfactor
+
+def get_formfactor_id(ifname, sysfs_root='/'):
+    key = (sysfs_root, ifname)
+    if key not in formfactor_cache:
+        formfactor_cache[key] = formfactor_id(*probe(ifname, sysfs_root))
+    return formfactor_cache[key]
+
+def formfactor_id(speed, formfactor):
     if speed == None: return 0
     elif formfactor == None:
         if speed == 1000: return 1000
         else: return 800
-    elif formfactor == 'SFP':  return 1100
-    elif formfactor == 'QSFP28' : return 1600
-    else : return 0
+    else: return FORMFACTOR_IDS.get(formfactor, 0)
+
+def clear_cache():
+    formfactor_cache.clear()
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,88 @@
+import glob
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import flow_control
+import metrics
+import netbox_client
+import snapshot
+import timing
+
+DEFAULT_WORKERS = 16
+
+
+class SharedLookups():
+    """
+    NetBox objects (site, rack, device role, device type...) resolved by
+    one agent and reused by every other agent of the same push.
+
+    Each key has its own lock, so concurrent agents needing the same
+    object wait for the first one to find or create it instead of creating
+    duplicates.
+    """
+    def __init__(self, max_requests):
+        self.lock = threading.Lock()
+        # Also taken by get_vlan/get_prefix, so hosts of the same site
+        # never create a VLAN or prefix twice
+        self.key_locks = flow_control.KeyLocks()
+        self.objects = {}
+        # Requests of the whole push are counted together
+        self.metrics = metrics.RequestMetrics()
+        # and limited together, backing off when NetBox slows down
+        self.limiter = flow_control.AIMDLimiter(max_requests)
+        # and written once, to the metrics files of the agents
+        self.metrics_files = set()
+
+    def get(self, key, lookup):
+        with self.key_locks.get(key):
+            if key not in self.objects:
+                self.objects[key] = lookup()
+            return self.objects[key]
+
+
+def snapshot_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, '*.json')))
+
+
+def push_snapshot(path, make_agent, lookups):
+    with timing.run(os.path.basename(path)) as root:
+        host = snapshot.SnapshotHost(snapshot.load(path))
+        agent = make_agent(host, lookups)
+        try:
+            agent.update_interfaces()
+            agent.update_pci()
+        finally:
+            with lookups.lock:
+                lookups.metrics_files.add(agent.metrics_file)
+            agent.close()
+    logging.debug('Push timings\n' + root.format())
+
+
+def push(directory, make_agent, workers=DEFAULT_WORKERS):
+    """
+    Sync every snapshot in directory to NetBox, running up to workers
+    agents at a time. make_agent(host, lookups) must return a NetBoxAgent
+    for the given host. Returns the paths of the snapshots that failed.
+    The metrics of the whole push are written once, at the end.
+    """
+    paths = snapshot_paths(directory)
+    logging.info('Pushing {0} snapshots from {1}'.format(len(paths),
+        directory))
+    lookups = SharedLookups(max(1, workers) *
+        netbox_client.DEFAULT_CONCURRENCY)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(push_snapshot, path, make_agent, lookups) :
+            path for path in paths}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logging.exception('Failed to push ' + futures[future])
+                failed.append(futures[future])
+    for path in lookups.metrics_files - {None}:
+        lookups.metrics.write(path)
+    return sorted(failed)
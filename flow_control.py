@@ -0,0 +1,140 @@
+"""
+Client-side flow control towards NetBox, so a whole fleet can sync at
+once without overloading it: a per-host start splay, retry backoff and an
+AIMD (additive increase, multiplicative decrease) limit on the requests
+in flight.
+"""
+import email.utils
+import hashlib
+import random
+import threading
+import time
+
+# Statuses meaning NetBox, or the proxy in front of it, is overloaded
+RETRY_STATUS = (429, 502, 503, 504)
+# Statuses returned before the request was processed, safe to retry for any
+# method. A 502/504 may come after a write went through.
+REJECTED_STATUS = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+MAX_RETRY_AFTER = 300.0
+
+# Latency above tolerance times the baseline, and above the baseline plus
+# slack, counts as congestion
+DEFAULT_TOLERANCE = 2.0
+LATENCY_SLACK = 0.05
+# How fast a latency baseline follows latencies above it
+BASELINE_DRIFT = 0.01
+DECREASE_FACTOR = 0.5
+
+
+def splay_delay(hostname, window):
+    """
+    Seconds to wait before starting, between 0 and window. Derived from
+    hostname, so each host starts at the same offset on every run and a
+    fleet started at once is spread over the whole window.
+    """
+    if window <= 0:
+        return 0.0
+    digest = hashlib.sha256(hostname.encode()).digest()
+    return window * int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def should_retry(method, status):
+    return status in REJECTED_STATUS or (status in RETRY_STATUS and
+        method in IDEMPOTENT_METHODS)
+
+
+def retry_after(value):
+    """Seconds from a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = date.timestamp() - time.time()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF, cap=MAX_BACKOFF,
+    server_delay=None):
+    """
+    Full-jitter exponential backoff before retry attempt (0 for the first
+    retry), never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if server_delay != None:
+        delay = max(delay, server_delay)
+    return delay
+
+
+class KeyLocks():
+    """
+    A lock per key, so threads finding or creating the same NetBox object
+    wait for each other while other objects are looked up concurrently.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+
+class AIMDLimiter():
+    """
+    Limit on concurrent requests that grows by one per round trip while
+    latency stays near its baseline, and halves (at most once per round
+    trip) when latency rises or NetBox reports it is overloaded.
+
+    acquire() blocks until a request may be sent; release() must follow
+    with the request's latency. Requests of different kinds, such as a brief
+    GET and a bulk POST, take very different times even when NetBox is
+    idle, so each key passed to release() has its own latency baseline.
+    """
+    def __init__(self, max_limit, min_limit=1, tolerance=DEFAULT_TOLERANCE):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.tolerance = tolerance
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.baselines = {}
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False, key=None):
+        with self.cond:
+            self.in_flight -= 1
+            if not overloaded:
+                baseline = self.baselines.get(key)
+                if baseline is None or latency < baseline:
+                    baseline = latency
+                else:
+                    baseline += (latency - baseline) * BASELINE_DRIFT
+                self.baselines[key] = baseline
+                overloaded = latency > max(baseline * self.tolerance,
+                    baseline + LATENCY_SLACK)
+
+            now = time.monotonic()
+            if overloaded:
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit *
+                        DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
@@ -0,0 +1,95 @@
+import logging
+import re
+import select
+import socket
+import threading
+import time
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_GROUP = 1
+
+DEFAULT_DEBOUNCE = 1.0
+
+SUBSYSTEMS = ('pci', 'nvme', 'net')
+
+PCI_ADDR = re.compile(r'^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$')
+
+
+def parse_uevent(data):
+    """
+    Decode a kernel uevent ('ACTION@DEVPATH\\0KEY=VALUE\\0...') into a dict
+    of its KEY=VALUE pairs.
+    """
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.decode('utf-8', 'replace').partition('=')
+        if sep:
+            event[key] = value
+    return event
+
+
+def event_pci_addr(event):
+    """
+    PCI address of the device an event is about, or None for events on
+    devices that are not behind a PCI function (e.g. virtual interfaces).
+    """
+    if event.get('SUBSYSTEM') == 'pci' and 'PCI_SLOT_NAME' in event:
+        return event['PCI_SLOT_NAME']
+    parts = [p for p in event.get('DEVPATH', '').split('/')
+        if PCI_ADDR.match(p)]
+    return parts[-1] if parts else None
+
+
+class HotplugWatcher(threading.Thread):
+    """
+    Watches kernel uevents for PCI, NVMe and network devices being added or
+    removed, and refreshes the inventory item of only the affected PCI
+    address once events have been quiet for debounce seconds.
+    """
+    def __init__(self, agent, debounce=DEFAULT_DEBOUNCE):
+        threading.Thread.__init__(self, name='hotplug', daemon=True)
+        self.agent = agent
+        self.debounce = debounce
+        self.pending = set()
+        self.last_event = None
+
+    def open_socket(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+            NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, KERNEL_GROUP))
+        return sock
+
+    def handle(self, data):
+        event = parse_uevent(data)
+        if (event.get('SUBSYSTEM') not in SUBSYSTEMS or
+            event.get('ACTION') not in ('add', 'remove', 'change', 'bind',
+            'unbind')):
+            return
+        pci_addr = event_pci_addr(event)
+        if pci_addr != None:
+            logging.debug('uevent {0} {1} for {2}'.format(event['ACTION'],
+                event['SUBSYSTEM'], pci_addr))
+            self.pending.add(pci_addr)
+            self.last_event = time.monotonic()
+
+    def push_pending(self):
+        pci_addrs, self.pending = sorted(self.pending), set()
+        with self.agent.sync_lock:
+            for pci_addr in pci_addrs:
+                self.agent.update_pci_device(pci_addr)
+
+    def run(self):
+        with self.open_socket() as sock:
+            while True:
+                timeout = None
+                if self.pending:
+                    timeout = max(0, self.last_event + self.debounce -
+                        time.monotonic())
+                ready, _, _ = select.select([sock], [], [], timeout)
+                if ready:
+                    self.handle(sock.recv(65536))
+                    continue
+                try:
+                    self.push_pending()
+                except Exception:
+                    logging.exception('Failed to update hotplugged devices')
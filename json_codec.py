@@ -0,0 +1,49 @@
+"""
+JSON encoding and decoding of NetBox request and response bodies:
+orjson when it is installed, the standard library json module otherwise.
+"""
+import json
+
+
+class StdlibCodec():
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec():
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        return self.orjson.dumps(obj)
+
+    def loads(self, data):
+        # orjson.JSONDecodeError is a ValueError, like json's
+        return self.orjson.loads(data)
+
+
+CODECS = {'json' : StdlibCodec, 'orjson' : OrjsonCodec}
+
+
+def get_codec(name=None):
+    """
+    The codec called name, or the fastest one installed if name is None.
+    Raises ImportError if the library of the codec named is missing.
+    """
+    if name is None:
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return StdlibCodec()
+    elif name not in CODECS:
+        raise ValueError('Unknown JSON codec {0}, use one of {1}'.format(
+            name, ', '.join(CODECS)))
+    return CODECS[name]()
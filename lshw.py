@@ -1,6 +1,13 @@
+import glob
+import json
 import subprocess
 import getpass
 
+import timing
+
+JSON_CLASSES = ['cpu', 'network', 'storage']
+
+@timing.timed_command
 def run_command(cmd, ignore_stderr = False):
     proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, 
     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -30,10 +37,7 @@ def run_command(cmd, ignore_stderr = False):
 
 def get_hw_linux(hwclass, device_id):
     out, err = run_command('lshw -class ' + hwclass)
-    if err != '':
-        if err == 'WARNING: you should run this program as super-user.\n': pass
-        elif err == 'WARNING: you should run this program as super-user.\nWARNING: output may be incomplete or inaccurate, you should run this program as super-user.\n' : pass
-        else: raise Exception(err)
+    check_stderr(err)
     HW_strs = out.split('  *-')
     HWs = []
     
@@ -62,5 +66,73 @@ def get_hw_linux(hwclass, device_id):
     return HWs
 
 
+def check_stderr(err):
+    if err != '':
+        if err == 'WARNING: you should run this program as super-user.\n': pass
+        elif err == 'WARNING: you should run this program as super-user.\nWARNING: output may be incomplete or inaccurate, you should run this program as super-user.\n' : pass
+        else: raise Exception(err)
+
+def iter_json_nodes(out):
+    """
+    Decode every top-level object in lshw -json output one at a time.
+    Depending on the lshw version, filtered output is either a JSON array or
+    a bare comma separated sequence of objects.
+    """
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(out) and out[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos >= len(out):
+            return
+        node, pos = decoder.raw_decode(out, pos)
+        yield node
+
+def walk_json_nodes(nodes, classes):
+    stack = list(reversed(list(nodes)))
+    while stack:
+        node = stack.pop()
+        if node.get('class') in classes:
+            yield node
+        stack.extend(reversed(node.get('children', [])))
+
+def get_nvme_model(pci_addr):
+    for path in glob.glob('/sys/bus/pci/devices/{0}/nvme/nvme*/model'.format(
+        pci_addr)):
+        with open(path) as model:
+            return model.read().strip()
+    raise Exception('failed to get NVMe model name for ' + pci_addr)
+
+def get_hw_linux_json(device_id, classes=JSON_CLASSES):
+    """
+    Run lshw once for all the given classes and return the matching nodes in
+    the same form as get_hw_linux.
+    """
+    out, err = run_command('lshw -json -quiet ' + ' '.join(
+        '-class ' + hwclass for hwclass in classes))
+    check_stderr(err)
+
+    HWs = []
+    for node in walk_json_nodes(iter_json_nodes(out), classes):
+        if 'businfo' not in node:
+            continue
+        HW = {'class' : node['class'],
+        'bus info' : str(device_id) + '@' + node['businfo']}
+        for key, prop in [('product', 'product'), ('description',
+            'description'), ('vendor', 'vendor'), ('logicalname',
+            'logical name')]:
+            if key in node:
+                HW[prop] = node[key]
+        if type(HW.get('logical name')) == list:
+            HW['logical name'] = HW['logical name'][0]
+
+        if node.get('configuration', {}).get('driver') == 'nvme':
+            HW['product'] = get_nvme_model(node['businfo'].split('@')[-1])
+        if node['class'] == 'cpu':
+            HW['description'] = 'Central Processing Unit'
+        HWs.append(HW)
+    return HWs
+
+
 if __name__ == "__main__":
     pass
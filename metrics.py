@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+# Request latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PREFIX = 'netbox_agent_'
+
+ACTIONS = {'POST' : 'created', 'PATCH' : 'updated', 'DELETE' : 'deleted'}
+
+
+def endpoint(base_url, url):
+    """
+    The endpoint of url (e.g. 'dcim/interfaces'), without object IDs and
+    query string.
+    """
+    path = urlparse(url).path
+    base_path = urlparse(base_url).path.rstrip('/')
+    if path.startswith(base_path + '/'):
+        path = path[len(base_path):]
+    return '/'.join(p for p in path.split('/') if p and not p.isdigit())
+
+
+class Histogram():
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {'buckets' : dict(zip((str(b) for b in self.buckets),
+            self.counts)), 'count' : self.count, 'sum' : self.sum}
+
+
+def labels(**kwargs):
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\',
+        '\\\\').replace('"', '\\"')) for k, v in kwargs.items()) + '}'
+
+
+class RequestMetrics():
+    """
+    Counters and latency histograms of the requests sent to NetBox, by
+    endpoint and method, and of the objects they created, updated and
+    deleted. Written out as a node_exporter textfile (.prom) or as JSON.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.latency = {}
+        self.bytes = Counter()
+        self.objects = Counter()
+        self.start = time.time()
+
+    def record(self, method, endpoint, status, latency, sent, received,
+        objects=0):
+        with self.lock:
+            self.requests[(endpoint, method, status)] += 1
+            if (endpoint, method) not in self.latency:
+                self.latency[(endpoint, method)] = Histogram(self.buckets)
+            self.latency[(endpoint, method)].observe(latency)
+            self.bytes[(endpoint, method, 'sent')] += sent
+            self.bytes[(endpoint, method, 'received')] += received
+            if objects > 0 and method in ACTIONS:
+                self.objects[(endpoint, ACTIONS[method])] += objects
+
+    def to_dict(self):
+        with self.lock:
+            return {'start' : self.start, 'duration' : time.time() -
+                self.start,
+                'requests' : [{'endpoint' : e, 'method' : m, 'status' : s,
+                'count' : n} for (e, m, s), n in sorted(
+                self.requests.items(), key=str)],
+                'latency' : [dict(h.to_dict(), endpoint=e, method=m)
+                for (e, m), h in sorted(self.latency.items())],
+                'bytes' : [{'endpoint' : e, 'method' : m, 'direction' : d,
+                'bytes' : n} for (e, m, d), n in sorted(self.bytes.items())],
+                'objects' : [{'endpoint' : e, 'action' : a, 'count' : n}
+                for (e, a), n in sorted(self.objects.items())]}
+
+    def prometheus_text(self):
+        data = self.to_dict()
+        lines = ['# HELP {}requests_total Requests sent to NetBox.'.format(
+            PREFIX), '# TYPE {}requests_total counter'.format(PREFIX)]
+        lines += ['{0}requests_total{1} {2}'.format(PREFIX, labels(
+            endpoint=r['endpoint'], method=r['method'], status=r['status']),
+            r['count']) for r in data['requests']]
+
+        name = PREFIX + 'request_duration_seconds'
+        lines += ['# HELP {} NetBox request latency.'.format(name),
+            '# TYPE {} histogram'.format(name)]
+        for h in data['latency']:
+            for bound, count in h['buckets'].items():
+                lines.append('{0}_bucket{1} {2}'.format(name, labels(
+                    endpoint=h['endpoint'], method=h['method'], le=bound),
+                    count))
+            lines.append('{0}_bucket{1} {2}'.format(name, labels(
+                endpoint=h['endpoint'], method=h['method'], le='+Inf'),
+                h['count']))
+            lines.append('{0}_sum{1} {2}'.format(name, labels(
+                endpoint=h['endpoint'], method=h['method']), h['sum']))
+            lines.append('{0}_count{1} {2}'.format(name, labels(
+                endpoint=h['endpoint'], method=h['method']), h['count']))
+
+        lines += ['# HELP {}request_bytes_total Request and response body '
+            'bytes.'.format(PREFIX),
+            '# TYPE {}request_bytes_total counter'.format(PREFIX)]
+        lines += ['{0}request_bytes_total{1} {2}'.format(PREFIX, labels(
+            endpoint=b['endpoint'], method=b['method'],
+            direction=b['direction']), b['bytes']) for b in data['bytes']]
+
+        lines += ['# HELP {}objects_total NetBox objects written.'.format(
+            PREFIX), '# TYPE {}objects_total counter'.format(PREFIX)]
+        lines += ['{0}objects_total{1} {2}'.format(PREFIX, labels(
+            endpoint=o['endpoint'], action=o['action']), o['count'])
+            for o in data['objects']]
+
+        lines += ['# HELP {}run_duration_seconds Time since the agent '
+            'started.'.format(PREFIX),
+            '# TYPE {}run_duration_seconds gauge'.format(PREFIX),
+            '{0}run_duration_seconds {1}'.format(PREFIX, data['duration']),
+            '# HELP {}last_run_timestamp_seconds When these metrics were '
+            'written.'.format(PREFIX),
+            '# TYPE {}last_run_timestamp_seconds gauge'.format(PREFIX),
+            '{0}last_run_timestamp_seconds {1}'.format(PREFIX, time.time())]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to path, as JSON if it ends with .json and in the
+        Prometheus text format otherwise. The file is replaced atomically,
+        as node_exporter's textfile collector requires.
+        """
+        if path.endswith('.json'):
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            text = self.prometheus_text()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(
+            path)), prefix=os.path.basename(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as metrics_file:
+            metrics_file.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
@@ -1,42 +1,42 @@
 #!/usr/bin/python3
-# requirement: requests, netifaces, netaddr, pyroute2
+# requirement: requests, netifaces, netaddr, pyroute2 (Linux, through
+# netlink_tables and ethtool); optional: orjson
 
+import asyncio
 import configparser
+import itertools
 import logging
 import os
 import re
-import socket
-import urllib
 import platform
+import threading
 
-import requests
-import dmidecode
 import netifaces
 import netaddr
 
+import netbox_client
+import bulk_writer
+import bootstrap_cache
+import device_state
+import flow_control
+import json_codec
+import metrics
+import planner
+import snapshot
+import sysfs_hw
+import timing
+
 if platform.system() == 'Linux':
-    import pyroute2, ethtool
-
-def get_phy_int(interface):        
-        ip = pyroute2.IPRoute()
-        if len(ip.link_lookup(ifname=interface)) == 0 :
-            return None
-        link = ip.link("get", index=ip.link_lookup(ifname=interface)[0])[0]        
-        if link.get_attr('IFLA_LINK_NETNSID') != None:
-            return None
-        elif link.get_attr('IFLA_LINKINFO') != None and get_link_type(link) != 'vlan':
-            return None
-        raw_link_id = list(filter(lambda x:x[0]=='IFLA_LINK', link['attrs']))
-        if len(raw_link_id) == 1:            
-            raw_index = raw_link_id[0][1]
-            try:
-                raw_link = ip.link("get", index=raw_index)[0]
-                phy_int=list(filter(lambda x:x[0]=='IFLA_IFNAME', raw_link['attrs']))[0][1]
-                return phy_int
-            except pyroute2.netlink.exceptions.NetlinkError:
-                return interface
-        else:
-            return interface
+    import netlink_tables
+
+def add_all(items, add):
+    for item in items:
+        add(item)
+
+def get_phy_int(interface, links=None):
+    if links == None:
+        links = netlink_tables.LinkTable.dump()
+    return links.phy_int(interface)
 
 def convert_v6_to_simple(addr, ifname):
     address = addr['addr'].replace('%{}'.format(ifname), '')
@@ -44,49 +44,186 @@ def convert_v6_to_simple(addr, ifname):
 
     return address, netmask
 
-def get_vid(vlan_if):
-    ip = pyroute2.IPRoute()
-    link = ip.get_links(ip.link_lookup(ifname=vlan_if)[0])[0]
-    vid = link.get_attr('IFLA_LINKINFO').get_attr('IFLA_INFO_DATA').get_attr(
-        'IFLA_VLAN_ID')
-    return vid
-
-def get_link_type(link):
-    return link.get_attr('IFLA_LINKINFO').get_attr('IFLA_INFO_KIND')    
+def get_vid(vlan_if, links=None):
+    if links == None:
+        links = netlink_tables.LinkTable.dump()
+    return links.vid(vlan_if)
+
+def get_primary(addrs, gateway):
+    """
+    The address of addrs to make the device's primary IP: the one on the
+    gateway's subnet, else the first one that is not link-local.
+    """
+    candidates = []
+    for adr in addrs:
+        ip = netaddr.IPNetwork('{0}/{1}'.format(adr['addr'].split('%')[0],
+            adr['netmask'].split('/')[-1]))
+        if ip.ip.is_link_local():
+            continue
+        elif (gateway != None and
+            netaddr.IPAddress(gateway.split('%')[0]) in ip):
+            return adr
+        candidates.append(adr)
+    return candidates[0] if candidates else None
+
+def truncate_name(data):
+    if 'name' in data and len(data['name']) > 50:
+        data['name'] = data['name'][:50]
+    return data
+
+# Fields read from objects that brief representations lack. Requested with
+# ?fields= when select_fields is set: only NetBox 4.0+ honours it, and the
+# payloads this agent writes (form_factor, integer status) are older's
+DEVICE_FIELDS = ('id', 'name', 'site', 'rack', 'device_role', 'device_type',
+    'position', 'face', 'primary_ip4', 'primary_ip6')
+DEVICE_TYPE_FIELDS = ('id', 'model', 'manufacturer')
+PREFIX_FIELDS = ('id', 'prefix', 'vlan')
+
+# Options describing one machine rather than the whole site
+PLACEMENT_KEYS = ('position', 'face', 'manufacturer', 'model_name', 'height')
+
+BOOTSTRAP_KEYS = ['api_base_url', 'sitename', 'rack_group', 'rack_name',
+    'device_role', 'position', 'face', 'manufacturer', 'model_name', 'height']
+
+def local_host(configFile):
+    """
+    (LocalHost, placement options) for this machine, as configured in
+    configFile if it exists. NetBox is not contacted.
+    """
+    config = configparser.ConfigParser()
+    config.read(configFile)
+    optional_conf = config['Optional'] if 'Optional' in config else {}
+    host = snapshot.LocalHost(optional_conf.get('sysfs_root', '/'),
+        optional_conf.get('dmi_cache', os.path.splitext(configFile)[0] +
+        '.dmi'))
+    return host, {k : optional_conf[k] for k in PLACEMENT_KEYS
+        if k in optional_conf}
 
 class NetBoxAgent():    
-    def __init__(self, configFile):
-
-        if not os.path.exists(configFile):
-            self.create_conf(configFile)
+    def __init__(self, configFile, host=None, lookups=None, plan=None):
 
-        config, optional_conf = self.load_conf(configFile)
+        with timing.span('config'):
+            if not os.path.exists(configFile):
+                self.create_conf(configFile)
+            config, optional_conf = self.load_conf(configFile)
         self.create_header(config['DEFAULT']['Token'])
-        self.get_site(config['DEFAULT']['sitename'])
-
-        if 'rack_group' in optional_conf: 
-            self.get_rack_group(optional_conf['rack_group'])
-        self.get_rack(config['DEFAULT']['rack_name'])
-        if 'position' in optional_conf:
-            self.rack_position = optional_conf['position']
-            self.rack_face = int(optional_conf['face'])
+        # With a plan, writes are recorded in it instead of being sent
+        self.plan = plan
+        # Agents pushing snapshots share lookups instead of the disk cache
+        self.lookups = lookups
+        self.create_client(optional_conf)
+
+        self.dmi_cache = optional_conf.get('dmi_cache',
+            os.path.splitext(configFile)[0] + '.dmi')
+        if host == None:
+            host = snapshot.LocalHost(self.sysfs_root, self.dmi_cache)
+        self.host = host
+
+        # A snapshot carries the placement of its own host
+        placement = host.placement()
+        if placement == None:
+            placement = optional_conf
+
+        if 'position' in placement:
+            self.rack_position = placement['position']
+            self.rack_face = int(placement['face'])
         else: self.rack_position = None
 
-        if 'manufacturer' in optional_conf:
-            self.manufacturer_name = optional_conf['manufacturer']
-            self.model_name = optional_conf['model_name']
+        if 'manufacturer' in placement:
+            self.manufacturer_name = placement['manufacturer']
+            self.model_name = placement['model_name']
         else : self.manufacturer_name = None
 
-        if 'height' in optional_conf:
-            self.height = optional_conf['height']
-        
-        if 'device_role_color' in config['DEFAULT']:
-            self.get_device(config['DEFAULT']['device_role'], 
-            config['DEFAULT']['device_role_color'])
-        else:
-            self.get_device(config['DEFAULT']['device_role'])
-        
-    
+        if 'height' in placement:
+            self.height = placement['height']
+
+        if lookups != None:
+            self.key_locks = lookups.key_locks
+        with timing.span('bootstrap'):
+            self.create_cache(configFile, optional_conf)
+            if lookups == None and self.load_cached_objects():
+                return
+
+            sitename = config['DEFAULT']['sitename']
+            self.lookup('site', (sitename,), self.get_site, sitename)
+            if 'rack_group' in optional_conf: 
+                self.lookup('rack_group', (self.site['id'],
+                    optional_conf['rack_group']), self.get_rack_group,
+                    optional_conf['rack_group'])
+            rack_name = config['DEFAULT']['rack_name']
+            self.lookup('rack', (self.site['id'], getattr(self, 'rack_group',
+                {}).get('id'), rack_name), self.get_rack, rack_name)
+
+            if 'device_role_color' in config['DEFAULT']:
+                self.get_device(config['DEFAULT']['device_role'], 
+                config['DEFAULT']['device_role_color'])
+            else:
+                self.get_device(config['DEFAULT']['device_role'])
+            if lookups == None and plan == None:
+                self.save_cached_objects()
+
+    def lookup(self, attr, key, func, *args):
+        """
+        Run func(*args), which sets self.<attr>, or reuse the object another
+        agent of the same push already found for key.
+        """
+        if self.lookups == None:
+            func(*args)
+            return
+
+        def find():
+            func(*args)
+            return getattr(self, attr)
+        setattr(self, attr, self.lookups.get((attr,) + key, find))
+
+    def create_cache(self, configFile, optional_conf):
+        key = {k : optional_conf.get(k) for k in BOOTSTRAP_KEYS}
+        key['hostname'] = self.host.hostname()
+        self.cache = bootstrap_cache.BootstrapCache(
+            bootstrap_cache.cache_path(configFile), key,
+            optional_conf.getint('cache_ttl', bootstrap_cache.DEFAULT_TTL))
+
+    def load_cached_objects(self):
+        ids = self.cache.load()
+        if ids == None:
+            return False
+
+        # A single GET is enough to check that every cached ID is still valid
+        device = self.query_get('dcim/devices/{}'.format(ids['device']), {},
+            fields=DEVICE_FIELDS)
+        if device == None or 'id' not in device:
+            logging.debug('Cached device {} not found'.format(ids['device']))
+            # Fall back to the full lookup, without the stale IDs if it fails
+            self.cache.clear()
+            return False
+        elif (device['site']['id'] != ids['site'] or
+            device['rack'] == None or device['rack']['id'] != ids['rack'] or
+            device['device_role']['id'] != ids['device_role'] or
+            device['device_type']['id'] != ids['device_type']):
+            logging.debug('Cached device {} has changed'.format(ids['device']))
+            self.cache.clear()
+            return False
+
+        logging.debug('Using cached objects for device ' + device['name'])
+        self.site = {'id' : ids['site']}
+        if ids['rack_group'] != None:
+            self.rack_group = {'id' : ids['rack_group']}
+        self.rack = device['rack']
+        self.device_role = device['device_role']
+        self.manufacturer = {'id' : ids['manufacturer']}
+        self.device_type = device['device_type']
+        self.device = device
+        return True
+
+    def save_cached_objects(self):
+        ids = {'site' : self.site['id'], 'rack' : self.rack['id'],
+        'rack_group' : None, 'device_role' : self.device_role['id'],
+        'manufacturer' : self.manufacturer['id'],
+        'device_type' : self.device_type['id'], 'device' : self.device['id']}
+        if hasattr(self, 'rack_group'):
+            ids['rack_group'] = self.rack_group['id']
+        self.cache.save(ids)
+
     def create_header(self, token):        
         self.headers = {
             'Content-Type': 'application/json',
@@ -94,6 +231,41 @@ class NetBoxAgent():
             'Authorization': 'Token ' + token
         }
 
+    def create_client(self, optional_conf):
+        timeout = optional_conf.getfloat('timeout',
+            netbox_client.DEFAULT_TIMEOUT)
+        concurrency = optional_conf.getint('concurrency',
+            netbox_client.DEFAULT_CONCURRENCY)
+        pool_size = max(concurrency, optional_conf.getint('pool_size',
+            netbox_client.DEFAULT_POOL_SIZE))
+        self.metrics_file = optional_conf.get('metrics_file')
+        if self.lookups != None:
+            self.metrics = self.lookups.metrics
+            limiter = self.lookups.limiter
+        else:
+            self.metrics = metrics.RequestMetrics()
+            limiter = None
+        self.client = netbox_client.NetBoxClient(self.base_url, self.headers,
+            timeout=timeout, pool_size=pool_size, request_metrics=self.metrics,
+            retries=optional_conf.getint('retries',
+            flow_control.DEFAULT_RETRIES), limiter=limiter,
+            codec=json_codec.get_codec(optional_conf.get('json_codec')),
+            compress_requests=optional_conf.getboolean('compress_requests',
+            False))
+        self.aclient = netbox_client.AsyncNetBoxClient(self.client,
+            concurrency)
+        # VLANs and prefixes are looked up from several interfaces at once;
+        # each is found or created once, under the lock of its key
+        self.key_locks = flow_control.KeyLocks()
+        self.sync_lock = threading.RLock()
+        self.sysfs_root = optional_conf.get('sysfs_root', '/')
+        self.page_size = optional_conf.getint('page_size',
+            netbox_client.DEFAULT_PAGE_SIZE)
+        self.select_fields = optional_conf.getboolean('select_fields', False)
+        self.writer = bulk_writer.BulkWriter(self.client,
+            optional_conf.getint('bulk_size', bulk_writer.DEFAULT_CHUNK_SIZE),
+            self.plan, self.aclient)
+
     def create_conf(self, configFile):
         logging.debug('Creating config file {}'.format(configFile))
         config = configparser.ConfigParser()        
@@ -135,54 +307,106 @@ class NetBoxAgent():
 
         return config, optional_conf
 
-    def query_get(self, obj_name, params):
-        param_str = urllib.parse.urlencode(params)
-        resp = requests.get('{0}/{1}/?{2}'.format(
-            self.base_url, obj_name, param_str),headers=self.headers).json()
-
-        if 'detail' in resp and resp['detail'] == 'Not found.': return None
-        elif 'results' in resp and len(resp['results']) == 0 : return None
-        elif 'results' in resp : return resp['results']
-        elif type(resp) == dict: return resp
-        else: raise Exception()
+    def query_get(self, obj_name, params, limit=None, brief=False,
+        fields=None):
+        if self.refers_to_planned(params): return None
+        resp = self.client.get(obj_name, self.page_params(params, limit, brief,
+            fields))
+        if resp.status_code == 404: return None
+        page = self.check_response(resp, 200, 'Failed to get ' + obj_name)
+
+        if 'results' in page:
+            # Lookups only tell one object from none or several, so no
+            # page is fetched after the second result
+            results = list(itertools.islice((item for page in
+                self.client.iter_pages(page) for item in page['results']), 2))
+            if len(results) == 0: return None
+            return results
+        elif type(page) == dict: return page
+        else: raise netbox_client.NetBoxError('Unexpected response to GET '
+            + obj_name, 'GET', resp.url, resp.status_code, page)
+
+    def query_iter(self, obj_name, params, limit=None, brief=False,
+        fields=None):
+        if self.refers_to_planned(params): return
+        resp = self.client.get(obj_name, self.page_params(params, limit, brief,
+            fields))
+        if resp.status_code == 404: return
+        resp = self.check_response(resp, 200, 'Failed to get ' + obj_name)
+
+        if 'results' not in resp: return
+        for page in self.client.iter_pages(resp):
+            for item in page['results']:
+                yield item
+
+    def refers_to_planned(self, params):
+        # Objects that are only planned have nothing referring to them yet
+        return self.plan != None and any(planner.is_planned(v)
+            for v in params.values())
+
+    def page_params(self, params, limit, brief=False, fields=None):
+        """
+        params with the page size and, to keep responses small, brief mode
+        (only id, url and name-like fields) or, if select_fields is set, the
+        fields selected.
+        """
+        params = dict(params)
+        params['limit'] = self.page_size if limit is None else limit
+        if brief:
+            params['brief'] = 1
+        if fields != None and self.select_fields:
+            params['fields'] = ','.join(fields)
+        return params
+
+    def query_count(self, obj_name, params):
+        """Number of objects matching params, read from a one-item page."""
+        if self.refers_to_planned(params): return 0
+        resp = self.client.get(obj_name, self.page_params(params, 1, True))
+        return self.check_response(resp, 200, 'Failed to count ' + obj_name
+            )['count']
+
+    def check_response(self, resp, status, message):
+        """
+        The decoded body of resp, or a NetBoxError if its status is not
+        status or its body is not JSON.
+        """
+        if resp.status_code != status:
+            raise netbox_client.NetBoxError.from_response(resp, message)
+        try:
+            return self.client.decode(resp)
+        except ValueError:
+            raise netbox_client.NetBoxError(message + ' : invalid JSON',
+                resp.request.method, resp.url, resp.status_code)
 
 
     def query_post(self, obj_name, data):
-        if 'name' in data and len(data['name']) > 50:
-            data['name'] = data['name'][:50]
-
-        resp = requests.post('{0}/{1}/'.format(self.base_url, obj_name), 
-        json=data, headers=self.headers, allow_redirects=False)
-        
-        if resp.status_code != 201: raise Exception(
-            'Failed to create {0} : {1} status {2}: {3}'
-            .format(obj_name, next(iter( data.items())), resp.status_code, 
-            resp.reason))
-        else : 
-            return resp.json()
+        truncate_name(data)
+        if self.plan != None:
+            return self.plan.add('POST', obj_name, data)
+        resp = self.client.post(obj_name, data)
+        return self.check_response(resp, 201, 'Failed to create {0} {1}'
+            .format(obj_name, next(iter(data.items()))))
 
     def query_delete(self, obj_name, id):        
-        resp = requests.delete('{0}/{1}/{2}/'.format(self.base_url, obj_name, 
-        id), headers=self.headers, allow_redirects=False)
+        if self.plan != None:
+            return self.plan.add('DELETE', obj_name, {'id' : id})
+        resp = self.client.delete(obj_name, id)
 
-        if resp.status_code != 204: raise Exception(
-            'Failed to delete {0} : {1} status {2}: {3}'
-            .format(obj_name, id, resp.status_code, resp.reason))
+        if resp.status_code != 204:
+            raise netbox_client.NetBoxError.from_response(resp,
+                'Failed to delete {0} {1}'.format(obj_name, id))
 
     def query_patch(self, obj_name, id, data):        
-        resp = requests.patch('{0}/{1}/{2}/'.format(self.base_url, obj_name, 
-        id), json=data, headers=self.headers, allow_redirects=False)
-
-        if resp.status_code != 200: raise Exception(
-            'Failed to patch {0} : {1} status {2}: {3}'
-            .format(obj_name, id, resp.status_code, resp.reason))
-        else : 
-            return resp.json() 
+        if self.plan != None:
+            return self.plan.add('PATCH', obj_name, dict(data, id=id))
+        resp = self.client.patch(obj_name, id, data)
+        return self.check_response(resp, 200, 'Failed to patch {0} {1}'
+            .format(obj_name, id))
 
     def get_site(self, sitename):        
         params = {'name' : sitename}
 
-        site = self.query_get('dcim/sites',params)
+        site = self.query_get('dcim/sites', params, brief=True)
         if site == None : self.create_site(sitename)
         else: self.site = site[0]
 
@@ -196,7 +420,7 @@ class NetBoxAgent():
     def get_rack_group(self, rack_group_name):
         params = {'site_id' : self.site['id'], 'name' : rack_group_name}
 
-        rack_group = self.query_get('dcim/rack-groups',params)
+        rack_group = self.query_get('dcim/rack-groups', params, brief=True)
         if rack_group == None: self.create_rack_group(rack_group_name)
         else: self.rack_group = rack_group[0]
 
@@ -215,7 +439,7 @@ class NetBoxAgent():
         if hasattr(self, 'rack_group'):
             params['group_id'] = self.rack_group['id']
         
-        rack = self.query_get('dcim/racks',params)
+        rack = self.query_get('dcim/racks', params, brief=True)
         if rack == None: self.create_rack(rack_name)
         else: self.rack = rack[0]
         
@@ -237,7 +461,7 @@ class NetBoxAgent():
     def get_device_role(self, device_role_name, color):
         params = {'name' : device_role_name}
 
-        device_role = self.query_get('dcim/device-roles', params)
+        device_role = self.query_get('dcim/device-roles', params, brief=True)
         if device_role == None: self.create_device_role(device_role_name,
             color)
         else: self.device_role = device_role[0]
@@ -254,7 +478,8 @@ class NetBoxAgent():
     def get_manufacturer(self, manufacturer):
         param = {'name' : manufacturer}
 
-        manufacturers = self.query_get('dcim/manufacturers', param)
+        manufacturers = self.query_get('dcim/manufacturers', param,
+            brief=True)
         if manufacturers == None : self.create_manufacturer(manufacturer)
         else : self.manufacturer = manufacturers[0]
 
@@ -271,41 +496,42 @@ class NetBoxAgent():
             self.manufacturer['name'], self.manufacturer['id']))
 
     def get_device_type(self):
-        sysinfo = dmidecode.profile()
-        
-        for item in sysinfo:
-            if self.manufacturer_name == None:
-                if 'system' in item[0] and ('Manufacturer' in item[1] and 
-                'Product Name' in item[1]):
-                    self.manufacturer_name = item[1]['Manufacturer']                
-                    self.model_name = item[1]['Product Name']                
-                    logging.debug('System information found {0} {1}'
-                    ''.format(self.manufacturer_name, self.model_name))
-            
-            if 'chassis' in item[0]:
-                height = item[1]['Height']
-                if height == 'Unspecified':
-                    if not hasattr(self, 'height'): self.height = 1                    
-                else : self.height = int(height.split(' ')[0])
-                logging.debug('Chassis information found. Height {0}'
-                ''.format(height))
-                        
-
-        self.get_manufacturer(self.manufacturer_name)
-        
+        with timing.span('dmi'):
+            sysinfo = self.host.dmi_profile()
+
+        system = sysinfo.first('system')
+        if self.manufacturer_name == None and system != None:
+            if 'Manufacturer' in system and 'Product Name' in system:
+                self.manufacturer_name = system['Manufacturer']
+                self.model_name = system['Product Name']
+                logging.debug('System information found {0} {1}'
+                ''.format(self.manufacturer_name, self.model_name))
+
+        for chassis in sysinfo.get('chassis'):
+            height = chassis['Height']
+            if height == 'Unspecified':
+                if not hasattr(self, 'height'): self.height = 1
+            else : self.height = int(height.split(' ')[0])
+            logging.debug('Chassis information found. Height {0}'
+            ''.format(height))
+
+        self.lookup('manufacturer', (self.manufacturer_name,),
+            self.get_manufacturer, self.manufacturer_name)
+        self.lookup('device_type', (self.manufacturer['id'], self.model_name),
+            self.find_device_type)
+
+    def find_device_type(self):
         param = {'model' : self.model_name}
-        device_type = self.query_get('dcim/device-types', param)
+        device_type = self.query_get('dcim/device-types', param,
+            fields=DEVICE_TYPE_FIELDS)
         if device_type == None: self.create_device_type(self.model_name,self.height)
         else : self.update_device_type(device_type[0])
             
     def update_device_type(self, device_type):
         if device_type['manufacturer']['id'] != self.manufacturer['id']:
             data = {'manufacturer' : self.manufacturer['id']}
-            self.query_patch('dcim/device-types', device_type['id'], data)        
-
-            param = {}
-            self.device_type = self.query_get('dcim/device-types/{}'.format(
-                device_type['id']), param)
+            self.device_type = dict(device_type, **self.query_patch(
+                'dcim/device-types', device_type['id'], data))
         else:
             self.device_type = device_type
         
@@ -324,12 +550,13 @@ class NetBoxAgent():
             self.device_type['model'], self.device_type['id']))
 
     def get_device(self, role, role_color="aa1409"):
-        device_name = socket.gethostname()
-        self.get_device_role(role, role_color)
+        device_name = self.host.hostname()
+        self.lookup('device_role', (role,), self.get_device_role, role,
+            role_color)
         self.get_device_type()
 
         param = {'name' : device_name}        
-        device = self.query_get('dcim/devices', param)        
+        device = self.query_get('dcim/devices', param, fields=DEVICE_FIELDS)
         if device == None : self.create_device(device_name)
         elif len(device) > 1: raise Exception('More than 1 device found with '
             'name {}'.format(device_name))
@@ -357,111 +584,181 @@ class NetBoxAgent():
         if self.rack_position != None:
             data['position'] = self.rack_position
             data['face'] = self.rack_face        
-        curr_device = self.query_patch('dcim/devices', prev_device['id'],data)
-        
-        if prev_device['device_type']['id'] != curr_device['device_type']['id']:             
-            self.check_empty_device_type(prev_device['device_type']['id'])
-        return curr_device
+        data = planner.changed_fields(prev_device, data)
+        if len(data) == 0:
+            return prev_device
+
+        # Sent with the first flush, merged with any other device update
+        callback = None
+        if 'device_type' in data:
+            callback = lambda _: self.check_empty_device_type(
+                prev_device['device_type']['id'])
+        self.writer.update('dcim/devices', prev_device['id'], data,
+            source=prev_device['name'], callback=callback)
+        return dict(prev_device, **planner.as_object(data))
 
     def check_empty_device_type(self, device_type_id):
         param = {'device_type_id' : device_type_id}
-        device = self.query_get('dcim/devices', param)
-        if device == None:
+        if self.query_count('dcim/devices', param) == 0:
             self.query_delete('dcim/device-types', device_type_id)
 
     def get_interfaces(self):
         param = {'device_id' : self.device['id']}
+        return self.query_iter('dcim/interfaces', param)
 
-        return self.query_get('dcim/interfaces', param)
-
-    def get_addresses(self, param):        
-        return self.query_get('ipam/ip-addresses', param)
-
+    def get_addresses(self):
+        param = {'device_id' : self.device['id']}
+        return self.query_iter('ipam/ip-addresses', param)
+
+    def get_state(self):
+        if getattr(self, 'state', None) == None:
+            with timing.span('fetch state'):
+                self.state = asyncio.run(self.fetch_state())
+        return self.state
+
+    async def fetch_state(self):
+        logging.debug('Fetching interfaces, addresses and inventory items')
+        # Objects are indexed as their pages arrive, so only the indexes
+        # and the current page of each list are held in memory
+        state = device_state.DeviceState()
+        await asyncio.gather(
+            self.aclient.call(add_all, self.get_interfaces(),
+                state.add_interface),
+            self.aclient.call(add_all, self.get_addresses(),
+                state.add_address),
+            self.aclient.call(add_all, self.get_hw(), state.add_inventory))
+        return state
+
+    def refresh_host_interfaces(self):
+        with timing.span('host interfaces'):
+            self.links, self.addrs = self.host.interfaces()
+        self.gateways = self.addrs.gateways()['default']
+
+    @timing.timed('update_interfaces')
     def update_interfaces(self):
         logging.debug("Updating network interfaces")
-        prev_ifaces = self.get_interfaces()        
-        curr_ifaces = netifaces.interfaces()
-        self.gateways =  netifaces.gateways()['default']
-        self.prev_ifnames = []
+        state = self.get_state()
+        prev_ifaces = state.interfaces()
+        self.refresh_host_interfaces()
+        curr_ifaces = self.addrs.interfaces()
+
+        prev_by_name = dict(state.interfaces_by_name)
+        self.prev_ifnames = list(prev_by_name)
 
         # Delete interfaces don't exist
-        if prev_ifaces != None:
-            self.prev_ifnames = [d['name'] for d in prev_ifaces]
-            for prev_if in prev_ifaces:
-                if prev_if['name'] not in curr_ifaces:                    
-                    self.delete_interface(prev_if)
-
-        for iface in curr_ifaces:            
-            if prev_ifaces is None or iface not in self.prev_ifnames:
-                self.create_interface(iface)
-            elif iface in self.prev_ifnames:
-                prev_iface = [d for d in prev_ifaces if d['name'] == iface][0]
-                self.update_addresses(iface, prev_iface)
+        for prev_if in prev_ifaces:
+            if prev_if['name'] not in curr_ifaces:
+                self.delete_interface(prev_if)
+
+        with timing.span('sync interfaces'):
+            asyncio.run(self.sync_interfaces(curr_ifaces, prev_by_name))
+        self.writer.flush()
+
+    @timing.timed('update_changed_interfaces')
+    def update_changed_interfaces(self, ifnames):
+        logging.debug('Updating changed interfaces ' + ', '.join(ifnames))
+        state = self.get_state()
+        self.refresh_host_interfaces()
+        curr_ifaces = set(self.addrs.interfaces())
+        self.prev_ifnames = list(state.interfaces_by_name)
+
+        for ifname in ifnames:
+            prev_iface = state.interface(ifname)
+            if ifname not in curr_ifaces:
+                if prev_iface != None: self.delete_interface(prev_iface)
+            elif prev_iface != None:
+                self.update_addresses(ifname, prev_iface)
+            elif ifname not in self.prev_ifnames:
+                self.create_interface(ifname)
+        self.writer.flush()
+
+    async def sync_interfaces(self, curr_ifaces, prev_by_name):
+        # Writes are queued on the BulkWriter, but creating an interface
+        # probes its form factor and looks up or creates its VLAN and
+        # prefixes: interfaces run on the client's pool, concurrency at a time
+        self.iface_tasks = {}
+        for iface in curr_ifaces:
+            self.schedule_interface(iface, prev_by_name)
+        await asyncio.gather(*self.iface_tasks.values())
+
+    def schedule_interface(self, iface, prev_by_name):
+        if iface not in self.iface_tasks:
+            self.iface_tasks[iface] = asyncio.ensure_future(
+                self.sync_interface(iface, prev_by_name))
+        return self.iface_tasks[iface]
+
+    async def sync_interface(self, iface, prev_by_name):
+        if iface in prev_by_name:
+            self.update_addresses(iface, prev_by_name[iface])
+            return
+        elif iface in self.prev_ifnames:
+            return
+
+        if self.host.system == 'Linux':
+            phy_int = get_phy_int(iface, self.links)
+            if phy_int != None and phy_int != iface:
+                # A VLAN interface is only created once its parent is
+                await self.schedule_interface(phy_int, prev_by_name)
+        await self.aclient.call(self.create_interface, iface)
 
     def create_interface(self, ifname):
         logging.debug('Creating interface ' + ifname)
-        addrs = netifaces.ifaddresses(ifname)
+        addrs = self.addrs.ifaddresses(ifname)
         
         data = {'device' : self.device['id'], 'name' : ifname}
         if netifaces.AF_LINK in addrs and addrs[netifaces.AF_LINK][0]['addr'] != '':
             data['mac_address'] = addrs[netifaces.AF_LINK][0]['addr']
 
         # TODO: get switch info from lldpd        
-        if platform.system() == 'Linux':
-            phy_int = get_phy_int(ifname)    
+        if self.host.system == 'Linux':
+            phy_int = get_phy_int(ifname, self.links)
             if phy_int == None:
                 logging.debug('No physical interface for {}. Ignoring'.format(
                     ifname))
                 return None
             elif phy_int != ifname:
                 logging.debug('{} is not a physical interface'.format(ifname))
-                interface = self.add_vlan_interface(ifname, phy_int, addrs)
-                
-            else:
-                import ethtool
-                ff = ethtool.get_formfactor_id(ifname)
-                data['form_factor'] = ff
-                if ff == 0:
-                    data.pop('mac_address')
-                interface = self.query_post('dcim/interfaces', data)
-                self.prev_ifnames.append(ifname)
-        else:
-            interface = self.query_post('dcim/interfaces', data)
-            self.prev_ifnames.append(ifname)
-            phy_int = ifname
-                
-        
+                self.add_vlan_interface(ifname, phy_int, addrs)
+                return
+
+            ff = self.host.formfactor_id(ifname)
+            data['form_factor'] = ff
+            if ff == 0:
+                data.pop('mac_address', None)
+
+        self.prev_ifnames.append(ifname)
+        self.writer.create('dcim/interfaces', truncate_name(data),
+            source=ifname, callback=lambda interface: self.interface_created(
+            interface, ifname, addrs))
+
+    def interface_created(self, interface, ifname, addrs, vlan_ifname = None):
+        self.state.add_interface(interface)
+        self.create_addresses(interface, ifname, addrs, vlan_ifname)
+
+    def create_addresses(self, interface, ifname, addrs, vlan_ifname = None):
+        created = set()
         for k,v in addrs.items():
             if not (k == netifaces.AF_INET or k == netifaces.AF_INET6):
                 continue
+            primary = None
+            if k in self.gateways and self.gateways[k][1] == ifname:
+                primary = get_primary(v, self.gateways[k][0])
             for adr in v:
-                if phy_int != ifname:
-                    if k == netifaces.AF_INET6:
-                        ipv6addrs = [i['address'] for i 
-                        in self.get_ip_addresses(interface) 
-                        if i['family'] == 6]
-                        
-                        address, netmask = convert_v6_to_simple(adr, ifname)
-                        adr_str = '{}/{}'.format(address,netmask)
-                        if adr_str in ipv6addrs:
-                            continue
-                    ipaddr = self.create_ip(adr, k, interface, ifname)
-                else:
-                    ipaddr = self.create_ip(adr, k, interface)
-                if (k in self.gateways and self.gateways[k][1] == ifname):
-                    self.update_pri_ip(ipaddr,k)
-
-        return interface
-
-    def get_ip_addresses(self, interface):
-        param = {'device_id' : self.device['id'], 'interface_id' : interface['id']}
-        return self.query_get('ipam/ip-addresses', param)
+                if vlan_ifname != None and k == netifaces.AF_INET6:
+                    address, netmask = convert_v6_to_simple(adr, vlan_ifname)
+                    adr_str = '{}/{}'.format(address,netmask)
+                    if adr_str in created:
+                        continue
+                    created.add(adr_str)
+                self.create_ip(adr, k, interface, vlan_ifname,
+                    adr is primary)
 
     def add_vlan_interface(self, vlan_if, phy_int, addrs):
         logging.debug('Adding vlan {} to {}'.format(vlan_if, phy_int))
-        vid = get_vid(vlan_if)
+        vid = get_vid(vlan_if, self.links)
 
-        vlan = self.get_vlan(vid)        
+        with self.key_locks.get(('vlan', self.site['id'], vid)):
+            vlan = self.get_vlan(vid)
         
         # create parent interface if not exist
         if phy_int not in self.prev_ifnames:
@@ -486,7 +783,9 @@ class NetBoxAgent():
         #         self.query_patch('dcim/interfaces',phy_interface['id'], data)
 
         data = {'device' : self.device['id'], 'name' : vlan_if, 'untagged_vlan' : vlan['id'], 'type' : 0, 'mode' : 100}
-        interface = self.query_post('dcim/interfaces', data)
+        self.writer.create('dcim/interfaces', truncate_name(data),
+            source=vlan_if, callback=lambda interface: self.interface_created(
+            interface, vlan_if, addrs, vlan_if))
         self.prev_ifnames.append(vlan_if)
 
         for k,v in addrs.items():
@@ -501,17 +800,18 @@ class NetBoxAgent():
                 elif k == netifaces.AF_INET:
                     ip = netaddr.IPNetwork(adr['addr'] + '/' + adr['netmask'])
                 
-                self.get_prefix(str(ip.cidr), vlan)                
-        return interface
+                with self.key_locks.get(('prefix', self.site['id'],
+                    str(ip.cidr))):
+                    self.get_prefix(str(ip.cidr), vlan)
 
     def get_prefix(self, cidr, vlan):
         param = {'q' : cidr, 'site_id' : self.site['id']} 
-        prefix = self.query_get('ipam/prefixes', param)        
+        prefix = self.query_get('ipam/prefixes', param, fields=PREFIX_FIELDS)
         if prefix == None:            
             prefix = self.create_prefix(cidr, vlan)
         elif len(prefix) > 1:
             raise Exception('More than 1 prefix found {}'.format(cidr))
-        elif prefix[0]['vlan'] != vlan['id']:
+        elif not planner.same_value(prefix[0]['vlan'], vlan['id']):
             data = {'vlan' : vlan['id']}
             self.query_patch('ipam/prefixes', prefix[0]['id'], data)
         return prefix
@@ -524,7 +824,7 @@ class NetBoxAgent():
 
     def get_vlan(self, vid):
         param = {'vid' : vid, 'site_id' : self.site['id']}
-        vlan =  self.query_get('ipam/vlans', param)
+        vlan = self.query_get('ipam/vlans', param, brief=True)
         if vlan == None:
             vlan = self.create_vlan(vid)
         elif len(vlan) > 1 : 
@@ -540,7 +840,8 @@ class NetBoxAgent():
         vlan = self.query_post('ipam/vlans', data)
         return vlan
 
-    def create_ip(self, addr, addr_family, iface, vlan_ifname = None):
+    def create_ip(self, addr, addr_family, iface, vlan_ifname = None,
+        primary = False):
         logging.debug('Creating ip {}'.format(addr['addr']))
         if (addr_family != netifaces.AF_INET and addr_family != netifaces.AF_INET6):
             logging.debug('Ignoring non-IP address {0} for {1} '
@@ -564,47 +865,51 @@ class NetBoxAgent():
 
         data = {'address' : '{0}/{1}'.format(address, netmask),
         'interface' : iface['id']}
-        ipaddr = self.query_post('ipam/ip-addresses', data)
-        return ipaddr        
+        self.writer.create('ipam/ip-addresses', data, source='{0} on {1}'
+            ''.format(data['address'], iface['name']),
+            callback=lambda ipaddr: self.ip_created(ipaddr, addr_family,
+            primary))
+
+    def ip_created(self, ipaddr, addr_family, primary):
+        self.state.add_address(ipaddr)
+        if primary:
+            self.update_pri_ip(ipaddr, addr_family)
 
     def delete_interface(self, iface):
         logging.debug("Deleting " + iface['name'])
-        self.query_delete('dcim/interfaces', iface['id'])
+        self.writer.delete('dcim/interfaces', iface['id'],
+            source=iface['name'],
+            callback=lambda _: self.state.remove_interface(iface))
 
     def update_addresses(self, iface, prev_iface):
         logging.debug("Updating interface address :" + iface)
-        param = {'device_id' : self.device['id'], 'interface_id' : prev_iface['id']}
-        prev_addrs = self.get_addresses(param)
-        curr_addrs = netifaces.ifaddresses(iface)
-        prev_ips = []
-        if prev_addrs != None: 
-            prev_ips = [d['address'].split('/')[0] for d in prev_addrs]
-        curr_ips = []             
+        prev_addrs = self.state.addresses(prev_iface['id'])
+        curr_addrs = self.addrs.ifaddresses(iface)
+        prev_ips = set(self.state.address_key(d) for d in prev_addrs)
+        curr_ips = set()
         
         if netifaces.AF_INET in curr_addrs:
             for curr_ipv4 in curr_addrs[netifaces.AF_INET]:
                 if curr_ipv4['addr'] not in prev_ips:
                     self.create_ip(curr_ipv4, netifaces.AF_INET, prev_iface)
-            curr_ips = [curr_addrs[k][0]['addr'] for k in [netifaces.AF_INET]]
+                curr_ips.add(curr_ipv4['addr'])
 
         if netifaces.AF_INET6 in curr_addrs:
             for curr_ipv6 in curr_addrs[netifaces.AF_INET6]:
                 curr_ipv6_addr = curr_ipv6['addr'].split('%')[0]
                 if curr_ipv6_addr not in prev_ips:
                     self.create_ip(curr_ipv6, netifaces.AF_INET6, prev_iface)
-            for ip6 in curr_addrs[netifaces.AF_INET6]:
-                curr_ips.append(ip6['addr'].replace('%{}'.format(iface),''))
+                curr_ips.add(curr_ipv6_addr)
 
-        if prev_addrs == None:
-            return            
         for prev_addr in prev_addrs:
-            prev_ip = prev_addr['address'].split('/')[0]
-            if len(curr_ips) == 0 or prev_ip not in curr_ips:
+            if self.state.address_key(prev_addr) not in curr_ips:
                 self.delete_ip(prev_addr)
 
     def delete_ip(self, ip):
         logging.debug("Deleting IP address " + ip['address'])
-        self.query_delete('ipam/ip-addresses', ip['id'])
+        self.writer.delete('ipam/ip-addresses', ip['id'],
+            source=ip['address'],
+            callback=lambda _: self.state.remove_address(ip))
         
     def update_pri_ip(self, ipaddr, addr_family):
         logging.debug("Updating Primary IP: " + ipaddr['address'])
@@ -616,52 +921,66 @@ class NetBoxAgent():
         elif addr_family == netifaces.AF_INET6:
             data['primary_ip6'] = ipaddr['id']
 
-        self.query_patch('dcim/devices', self.device['id'], data)
+        data = planner.changed_fields(self.device, data)
+        if len(data) > 0:
+            self.device.update(planner.as_object(data))
+            self.writer.update('dcim/devices', self.device['id'], data,
+                source=self.device['name'])
 
+    @timing.timed('update_pci')
     def update_pci(self):
-        if platform.system() == 'Windows':
-            pass
-        elif platform.system() == 'Linux':
-            import lshw
-            cpus = lshw.get_hw_linux('cpu', self.device['id'])
-            nics = lshw.get_hw_linux('network', self.device['id'])            
-            #self.update_hw(nics, 'product')
-            phy_nics = [d for d in nics if 'product' in d]
-            storages = lshw.get_hw_linux('storage', self.device['id'])
-            hw = cpus + phy_nics + storages
-            self.update_hw(hw)
-        elif platform.system() == 'Darwin':
-            pass
-        else:
-            pass
+        with timing.span('hw discovery'):
+            hws = self.host.hw(self.device['id'])
+        if hws != None:
+            self.update_hw(hws)
 
     def update_hw(self, hws):
-        prev_hws = self.get_hw()
-        if prev_hws != None:
-            prev_hws_tags = [d['asset_tag'] for d in prev_hws]
-            curr_hws_tags = [d['bus info'] for d in hws if 'bus info' in d]
-
-            for prev_hw in prev_hws:
-                if (prev_hw['asset_tag'] not in curr_hws_tags or 
-                self.is_hw_changed(prev_hw, hws)):
-                    self.delete_hw(prev_hw)
-
-        for hw in hws:            
-            if prev_hws == None or hw['bus info'] not in prev_hws_tags:
+        state = self.get_state()
+        curr_hws = {d['bus info'] : d for d in hws if 'bus info' in d}
+
+        deleted_tags = set()
+
+        for prev_hw in state.inventory():
+            if self.is_hw_changed(prev_hw, curr_hws):
+                self.delete_hw(prev_hw)
+                deleted_tags.add(prev_hw['asset_tag'])
+
+        for hw in hws:
+            if (hw['bus info'] not in state.inventory_by_tag or
+                hw['bus info'] in deleted_tags):
                 self.create_inventory(hw)
+
+        self.writer.flush()
     
+    @timing.timed('update_pci_device')
+    def update_pci_device(self, pci_addr):
+        logging.debug('Updating HW inventory for ' + pci_addr)
+        state = self.get_state()
+        found = sysfs_hw.get_pci_devices(self.device['id'], self.sysfs_root,
+            [pci_addr])
+        curr_hws = {d['bus info'] : d for d in found}
+        prev_hw = state.inventory_by_tag.get('{0}@pci@{1}'.format(
+            self.device['id'], pci_addr))
+
+        changed = prev_hw != None and self.is_hw_changed(prev_hw, curr_hws)
+        if changed:
+            self.delete_hw(prev_hw)
+        if len(found) > 0 and (prev_hw == None or changed):
+            self.create_inventory(found[0])
+        self.writer.flush()
+
     def is_hw_changed(self, prev_hw, curr_hws):
-        matching_devices = [d for d in curr_hws if d['bus info'] == prev_hw['asset_tag']]
-        if len(matching_devices) == 0:
+        matching_device = curr_hws.get(prev_hw['asset_tag'])
+        if matching_device == None:
             return True
-        elif 'product' in matching_devices[0]:
-            return matching_devices[0]['product'][:50] != prev_hw['name']
+        elif 'product' in matching_device:
+            return matching_device['product'][:50] != prev_hw['name']
         else:
-            return matching_devices[0]['description'][:50] != prev_hw['name']
+            return matching_device['description'][:50] != prev_hw['name']
  
     def get_hw(self):
         params = {'device_id' : self.device['id']}
-        return self.query_get('dcim/inventory-items', params)
+        return self.query_iter('dcim/inventory-items', params)
 
     def create_inventory(self, hw):
         logging.debug("Creating HW inventory " + hw['description'])        
@@ -673,16 +992,114 @@ class NetBoxAgent():
         else:
             data['name'] = hw['description']       
 
-        self.query_post('dcim/inventory-items',data)
+        self.writer.create('dcim/inventory-items', truncate_name(data),
+            source=hw['bus info'], callback=self.state.add_inventory)
+
+    def write_metrics(self):
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file)
+
+    def close(self):
+        self.aclient.close()
+        self.client.close()
 
     def delete_hw(self, hw):
         logging.debug('Deleting HW inventory' + hw['name'])
-        self.query_delete('dcim/inventory-items', hw['id'])
+        self.writer.delete('dcim/inventory-items', hw['id'],
+            source=hw['asset_tag'],
+            callback=lambda _: self.state.remove_inventory(hw))
             
 
 if __name__=='__main__':    
+    import argparse
+    import contextlib
+    import sys
+    import time
+    import agent_daemon
+    import fleet
+
+    parser = argparse.ArgumentParser(
+        description='Add this machine to a NetBox server')
+    parser.add_argument('-c', '--config', default='netbox_agent.cfg')
+    parser.add_argument('--daemon', action='store_true',
+        help='keep running and push interface changes as they happen')
+    parser.add_argument('--debounce', type=float,
+        default=agent_daemon.DEFAULT_DEBOUNCE,
+        help='seconds without events before changes are pushed')
+    parser.add_argument('--reconcile-interval', type=float,
+        default=agent_daemon.DEFAULT_RECONCILE_INTERVAL,
+        help='seconds between full syncs in daemon mode')
+    parser.add_argument('--collect', metavar='FILE',
+        help='only discover this machine and write a snapshot to FILE')
+    parser.add_argument('--push', metavar='DIR',
+        help='sync every snapshot (*.json) in DIR instead of this machine')
+    parser.add_argument('--workers', type=int, default=fleet.DEFAULT_WORKERS,
+        help='snapshots pushed in parallel')
+    parser.add_argument('--plan', action='store_true',
+        help='print the changes a sync would make without making them')
+    parser.add_argument('--metrics', metavar='FILE',
+        help='write request metrics to FILE (.prom textfile or .json)')
+    parser.add_argument('--splay', type=float, default=0,
+        help='wait up to this many seconds, at an offset derived from the '
+        'hostname, before contacting NetBox')
+    parser.add_argument('--profile', choices=timing.PROFILERS,
+        help='print the slowest functions (cprofile) or biggest '
+        'allocations (tracemalloc) of the run')
+    parser.add_argument('--profile-output', metavar='FILE',
+        help='also write the pstats or tracemalloc snapshot dump to FILE')
+    args = parser.parse_args()
+
+    def make_agent(host=None, lookups=None, plan=None):
+        agent = NetBoxAgent(args.config, host, lookups, plan)
+        if args.metrics:
+            agent.metrics_file = args.metrics
+        return agent
+
+    def run():
+        if args.collect:
+            snapshot.save(snapshot.collect(*local_host(args.config)),
+                args.collect)
+            print('collected')
+            return 0
+        elif args.push:
+            failed = fleet.push(args.push, make_agent, args.workers)
+            print('updated, {} failed'.format(len(failed)))
+            return 1 if failed else 0
+
+        if args.plan:
+            agent = make_agent(plan=planner.Plan())
+            agent.update_interfaces()
+            agent.update_pci()
+            agent.close()
+            agent.plan.show()
+            return 0
+
+        delay = flow_control.splay_delay(snapshot.LocalHost().hostname(),
+            args.splay)
+        if delay > 0:
+            logging.info('Waiting {:.1f}s before syncing'.format(delay))
+            time.sleep(delay)
+        agent = make_agent()
+        if args.daemon:
+            agent_daemon.AgentDaemon(agent, args.debounce,
+                args.reconcile_interval).run()
+        else:
+            try:
+                agent.update_interfaces()
+                agent.update_pci()
+            finally:
+                agent.write_metrics()
+        agent.close()
+        print('updated')
+        return 0
+
     logging.basicConfig(level=logging.DEBUG)
-    agent = NetBoxAgent('netbox_agent.cfg')
-    agent.update_interfaces()
-    agent.update_pci()
-    print('updated')
+    profiler = contextlib.nullcontext()
+    if args.profile:
+        profiler = timing.profiled(args.profile, args.profile_output)
+    try:
+        with profiler, timing.run('netbox_agent') as root:
+            status = run()
+    finally:
+        logging.info('Run timings\n' + root.format())
+    sys.exit(status)
@@ -0,0 +1,243 @@
+import asyncio
+import contextvars
+import functools
+import gzip
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import flow_control
+import json_codec
+import metrics
+import timing
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 4
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_CONCURRENCY = 8
+# Request bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+
+class NetBoxError(Exception):
+    """
+    A NetBox request failed: status is the HTTP status and detail the
+    error NetBox returned, if any.
+    """
+    def __init__(self, message, method, url, status=None, detail=None):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.detail = detail
+        super().__init__(message if detail is None else '{0}: {1}'.format(
+            message, detail))
+
+    @classmethod
+    def from_response(cls, resp, message):
+        try:
+            detail = resp.json()
+        except ValueError:
+            detail = resp.reason
+        return cls('{0} : status {1}'.format(message, resp.status_code),
+            resp.request.method, resp.url, resp.status_code, detail)
+
+
+class NetBoxClient():
+    """
+    HTTP client for the NetBox REST API.
+
+    Owns a single requests.Session so every call made during a sync reuses
+    the same keep-alive connection(s) and authentication headers. Every
+    request is recorded in a metrics.RequestMetrics.
+
+    Requests NetBox rejects as overloaded (see flow_control.should_retry)
+    are retried up to retries times with jittered exponential backoff,
+    honouring Retry-After. The requests in flight are limited by a
+    flow_control.AIMDLimiter, shared by every client of a push.
+
+    Bodies are encoded and decoded with codec (a json_codec codec, the
+    fastest installed by default). Responses are requested gzip or deflate
+    compressed, and with compress_requests, request bodies of at least
+    COMPRESS_MIN_SIZE bytes are sent gzipped. Only some servers accept
+    those: if NetBox cannot parse one, it is sent again uncompressed and
+    compression is turned off.
+    """
+    def __init__(self, base_url, headers, timeout=DEFAULT_TIMEOUT,
+        pool_size=DEFAULT_POOL_SIZE, request_metrics=None,
+        retries=flow_control.DEFAULT_RETRIES, limiter=None, codec=None,
+        compress_requests=False):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        if request_metrics is None:
+            request_metrics = metrics.RequestMetrics()
+        self.metrics = request_metrics
+        self.retries = retries
+        if limiter is None:
+            limiter = flow_control.AIMDLimiter(pool_size)
+        self.limiter = limiter
+        if codec is None:
+            codec = json_codec.get_codec()
+        self.codec = codec
+        self.compress_requests = compress_requests
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.headers['Connection'] = 'keep-alive'
+        # Decoded transparently by urllib3
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, obj_name, id=None):
+        if id is None:
+            return '{0}/{1}/'.format(self.base_url, obj_name)
+        return '{0}/{1}/{2}/'.format(self.base_url, obj_name, id)
+
+    def request(self, method, url, json=None, **kwargs):
+        """
+        Send a request, with json (if given) as its body, retrying while
+        NetBox is overloaded.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = metrics.endpoint(self.base_url, url)
+        objects = len(json) if type(json) == list else 1
+        if json is None:
+            return self.retry(method, url, endpoint, objects, **kwargs)
+
+        body = self.codec.dumps(json)
+        headers = {'Content-Type' : 'application/json'}
+        if self.compress_requests and len(body) >= COMPRESS_MIN_SIZE:
+            resp = self.retry(method, url, endpoint, objects,
+                data=gzip.compress(body, COMPRESS_LEVEL), headers=dict(
+                headers, **{'Content-Encoding' : 'gzip'}), **kwargs)
+            if not (resp.status_code == 415 or (resp.status_code == 400 and
+                b'parse error' in resp.content.lower())):
+                return resp
+            logging.warning('NetBox does not accept compressed requests, '
+                'sending them uncompressed')
+            self.compress_requests = False
+        return self.retry(method, url, endpoint, objects, data=body,
+            headers=headers, **kwargs)
+
+    def retry(self, method, url, endpoint, objects, **kwargs):
+        attempt = 0
+        while True:
+            resp = self.send(method, url, endpoint, objects, **kwargs)
+            if (attempt >= self.retries or
+                not flow_control.should_retry(method, resp.status_code)):
+                return resp
+            delay = flow_control.backoff_delay(attempt,
+                server_delay=flow_control.retry_after(
+                resp.headers.get('Retry-After')))
+            logging.warning('{0} {1} : status {2}, retrying in {3:.1f}s'
+                ''.format(method, url, resp.status_code, delay))
+            resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def send(self, method, url, endpoint, objects, **kwargs):
+        logging.debug('{0} {1}'.format(method, url))
+        self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            with timing.span('{0} {1}'.format(method, endpoint)):
+                resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            latency = time.perf_counter() - start
+            self.limiter.release(latency, overloaded=True,
+                key=(method, endpoint))
+            self.metrics.record(method, endpoint, 'error', latency, 0, 0)
+            raise
+        latency = time.perf_counter() - start
+        self.limiter.release(latency, overloaded=resp.status_code in
+            flow_control.RETRY_STATUS, key=(method, endpoint))
+
+        if not 200 <= resp.status_code < 300 or method == 'GET':
+            objects = 0
+        # Bytes on the wire, before the response is decompressed
+        received = resp.raw.tell() if resp.raw is not None else len(
+            resp.content)
+        self.metrics.record(method, endpoint, resp.status_code, latency,
+            len(resp.request.body or b''), received, objects)
+        return resp
+
+    def decode(self, resp):
+        """The JSON body of resp. Raises ValueError if it is not JSON."""
+        return self.codec.loads(resp.content)
+
+    def get(self, obj_name, params=None, id=None):
+        return self.request('GET', self.url(obj_name, id), params=params)
+
+    def iter_pages(self, page):
+        """
+        Yield page and every following page of a paginated list response.
+        Pages are fetched lazily by following the 'next' links.
+        """
+        while True:
+            yield page
+            if not page.get('next'):
+                break
+            resp = self.request('GET', page['next'])
+            if resp.status_code != 200: raise NetBoxError.from_response(
+                resp, 'Failed to get ' + page['next'])
+            page = self.decode(resp)
+
+    def post(self, obj_name, data):
+        return self.request('POST', self.url(obj_name), json=data,
+            allow_redirects=False)
+
+    def patch(self, obj_name, id, data):
+        return self.request('PATCH', self.url(obj_name, id), json=data,
+            allow_redirects=False)
+
+    def delete(self, obj_name, id):
+        return self.request('DELETE', self.url(obj_name, id),
+            allow_redirects=False)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncNetBoxClient():
+    """
+    asyncio front end for a NetBoxClient.
+
+    Blocking calls are run on a thread pool sharing the client's session,
+    with at most concurrency of them in flight at a time.
+    """
+    def __init__(self, client, concurrency=DEFAULT_CONCURRENCY):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.loop = self.semaphore = None
+
+    def get_semaphore(self):
+        # asyncio primitives are bound to the loop they are first used in
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+    async def call(self, func, *args, **kwargs):
+        # Run in the caller's context so its timing span is kept
+        context = contextvars.copy_context()
+        async with self.get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(context.run, func, *args,
+                **kwargs))
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,146 @@
+import ipaddress
+import socket
+from collections import namedtuple
+
+import pyroute2
+
+import timing
+
+# netifaces' AF_LINK on Linux
+AF_LINK = getattr(socket, 'AF_PACKET', 17)
+MAIN_TABLE = 254
+
+Link = namedtuple('Link', ['index', 'name', 'kind', 'parent', 'netnsid',
+    'vid', 'mac'])
+
+
+def decode_link(msg):
+    kind = vid = None
+    linkinfo = msg.get_attr('IFLA_LINKINFO')
+    if linkinfo != None:
+        kind = linkinfo.get_attr('IFLA_INFO_KIND')
+        info_data = linkinfo.get_attr('IFLA_INFO_DATA')
+        if kind == 'vlan' and info_data != None:
+            vid = info_data.get_attr('IFLA_VLAN_ID')
+
+    return Link(index=msg['index'], name=msg.get_attr('IFLA_IFNAME'),
+        kind=kind, parent=msg.get_attr('IFLA_LINK'),
+        netnsid=msg.get_attr('IFLA_LINK_NETNSID'), vid=vid,
+        mac=msg.get_attr('IFLA_ADDRESS'))
+
+
+class LinkTable():
+    """
+    Snapshot of the host's links taken with a single RTM_GETLINK dump,
+    indexed by name and ifindex.
+    """
+    def __init__(self, links=()):
+        self.by_name = {}
+        self.by_index = {}
+        for link in links:
+            self.add(link)
+
+    @classmethod
+    @timing.timed('netlink link dump')
+    def dump(cls):
+        with pyroute2.IPRoute() as ip:
+            return cls(decode_link(msg) for msg in ip.get_links())
+
+    def add(self, link):
+        self.by_name[link.name] = link
+        self.by_index[link.index] = link
+
+    def remove(self, name):
+        link = self.by_name.pop(name, None)
+        if link != None:
+            self.by_index.pop(link.index, None)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def phy_int(self, name):
+        """
+        Name of the physical interface behind name: name itself for a
+        physical interface, the parent for a VLAN, None for links of any
+        other kind or that belong to another network namespace.
+        """
+        link = self.by_name.get(name)
+        if link == None or link.netnsid != None:
+            return None
+        elif link.kind != None and link.kind != 'vlan':
+            return None
+        elif link.parent != None and link.parent in self.by_index:
+            return self.by_index[link.parent].name
+        return name
+
+    def vid(self, name):
+        return self.by_name[name].vid
+
+
+def decode_addr(msg):
+    address = msg.get_attr('IFA_LOCAL') or msg.get_attr('IFA_ADDRESS')
+    return msg['index'], msg['family'], {
+        'addr' : str(ipaddress.ip_address(address)),
+        'netmask' : str(msg['prefixlen']), 'prefixlen' : msg['prefixlen']}
+
+
+def decode_default_route(msg):
+    oif, gateway = msg.get_attr('RTA_OIF'), msg.get_attr('RTA_GATEWAY')
+    if oif == None and msg.get_attr('RTA_MULTIPATH'):
+        hop = msg.get_attr('RTA_MULTIPATH')[0]
+        oif, gateway = hop['oif'], hop.get_attr('RTA_GATEWAY')
+    return msg['family'], msg.get_attr('RTA_PRIORITY') or 0, oif, gateway
+
+
+class AddressTable():
+    """
+    Snapshot of every interface address and the default gateways, taken
+    with one RTM_GETADDR and one RTM_GETROUTE dump.
+
+    interfaces(), ifaddresses() and gateways() return the same shapes as
+    the netifaces functions, with addresses canonicalized (no scope suffix)
+    and the netmask given as a prefix length for both families.
+    """
+    def __init__(self, links, addresses=(), default_routes=()):
+        self.links = links
+        self.addrs = {}
+        self.default_gateways = {}
+
+        for index, family, addr in addresses:
+            self.addrs.setdefault(index, {}).setdefault(family, []).append(
+                addr)
+
+        for family, priority, oif, gateway in sorted(default_routes,
+            key=lambda route: route[1], reverse=True):
+            if oif in links.by_index:
+                self.default_gateways[family] = (gateway,
+                    links.by_index[oif].name, True)
+
+    @classmethod
+    @timing.timed('netlink address dump')
+    def dump(cls, links=None):
+        with pyroute2.IPRoute() as ip:
+            if links == None:
+                links = LinkTable(decode_link(msg) for msg in ip.get_links())
+            addresses = [decode_addr(msg) for msg in ip.get_addr()]
+            routes = [decode_default_route(msg) for msg in
+                ip.get_routes(table=MAIN_TABLE) if msg['dst_len'] == 0 and
+                msg.get_attr('RTA_DST') == None]
+        return cls(links, addresses, routes)
+
+    def interfaces(self):
+        return list(self.links.by_name)
+
+    def ifaddresses(self, name):
+        link = self.links.get(name)
+        if link == None:
+            raise ValueError('You must specify a valid interface name.')
+
+        addrs = {family : list(family_addrs) for family, family_addrs
+            in self.addrs.get(link.index, {}).items()}
+        if link.mac != None:
+            addrs[AF_LINK] = [{'addr' : link.mac}]
+        return addrs
+
+    def gateways(self):
+        return {'default' : dict(self.default_gateways)}
@@ -0,0 +1,98 @@
+import json
+from collections import namedtuple
+
+# Fields NetBox returns as nested objects but takes as plain IDs
+NESTED_FIELDS = ('site', 'group', 'rack', 'device_role', 'manufacturer',
+    'device_type', 'device', 'interface', 'vlan', 'untagged_vlan',
+    'primary_ip4', 'primary_ip6')
+
+VERBS = {'POST' : 'create', 'PATCH' : 'update', 'DELETE' : 'delete'}
+
+Operation = namedtuple('Operation', ['method', 'obj_name', 'source', 'data'])
+
+
+def field_value(value):
+    """
+    The plain value of a field as read from NetBox: the ID of a nested
+    object, the value of a choice field.
+    """
+    if type(value) == dict:
+        if 'id' in value: return value['id']
+        elif 'value' in value: return value['value']
+    return value
+
+
+def same_value(current, desired):
+    current = field_value(current)
+    if current == desired:
+        return True
+    # Numbers may come back as a different type (e.g. position '2' vs 2.0)
+    try:
+        return float(current) == float(desired)
+    except (TypeError, ValueError):
+        return False
+
+
+def changed_fields(current, desired):
+    """
+    The items of desired that differ from the object current, i.e. the
+    smallest PATCH that makes current match desired.
+    """
+    return {k : v for k, v in desired.items() if k not in current or
+        not same_value(current[k], v)}
+
+
+def as_object(data):
+    """
+    data as NetBox would return it once written, with IDs of related
+    objects nested.
+    """
+    return {k : {'id' : v} if k in NESTED_FIELDS and type(v) == int else v
+        for k, v in data.items()}
+
+
+def is_planned(id):
+    return type(id) == int and id < 0
+
+
+class Plan():
+    """
+    Records the writes a sync would make instead of sending them.
+
+    Created objects are given negative placeholder IDs, so the agent can
+    keep planning the objects that depend on them; NetBox never has any
+    object referring to a placeholder.
+    """
+    def __init__(self):
+        self.operations = []
+        self.last_id = 0
+
+    def add(self, method, obj_name, data, source=None):
+        if source is None:
+            source = data.get('name', data.get('model', data.get('id')))
+        self.operations.append(Operation(method, obj_name, source, data))
+        if method == 'DELETE':
+            return None
+
+        result = as_object(data)
+        if method == 'POST':
+            self.last_id -= 1
+            result['id'] = self.last_id
+        return result
+
+    def __len__(self):
+        return len(self.operations)
+
+    def lines(self):
+        for op in self.operations:
+            data = {k : v for k, v in op.data.items() if k != 'id'}
+            line = '{0} {1} {2}'.format(VERBS[op.method], op.obj_name,
+                op.source)
+            if op.method != 'DELETE':
+                line += ' ' + json.dumps(data, sort_keys=True)
+            yield line
+
+    def show(self):
+        for line in self.lines():
+            print(line)
+        print('{} change(s) planned'.format(len(self)))
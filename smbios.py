@@ -0,0 +1,308 @@
+"""
+Decoder for the raw SMBIOS tables exported by Linux in
+/sys/firmware/dmi/tables. Only the structure types used by the agent are
+decoded, into the same (type name, dict) tuples as dmidecode.parse_dmi.
+"""
+import os
+import struct
+
+TABLES_DIR = '/sys/firmware/dmi/tables'
+
+END_OF_TABLE = 127
+
+TITLES = {
+    0 : ('bios', 'BIOS Information'),
+    1 : ('system', 'System Information'),
+    3 : ('chassis', 'Chassis Information'),
+    4 : ('processor', 'Processor Information'),
+    17 : ('memory device', 'Memory Device'),
+}
+
+# Names of the processor family codes, as printed by dmidecode. 0x30 and
+# 0xBE depend on the manufacturer, see processor_family.
+PROCESSOR_FAMILIES = {
+    0x01 : 'Other', 0x02 : 'Unknown', 0x03 : '8086', 0x04 : '80286',
+    0x05 : '80386', 0x06 : '80486', 0x07 : '8087', 0x08 : '80287',
+    0x09 : '80387', 0x0A : '80487', 0x0B : 'Pentium', 0x0C : 'Pentium Pro',
+    0x0D : 'Pentium II', 0x0E : 'Pentium MMX', 0x0F : 'Celeron',
+    0x10 : 'Pentium II Xeon', 0x11 : 'Pentium III', 0x12 : 'M1', 0x13 : 'M2',
+    0x14 : 'Celeron M', 0x15 : 'Pentium 4 HT',
+    0x18 : 'Duron', 0x19 : 'K5', 0x1A : 'K6', 0x1B : 'K6-2', 0x1C : 'K6-3',
+    0x1D : 'Athlon', 0x1E : 'AMD29000', 0x1F : 'K6-2+',
+    0x20 : 'Power PC', 0x21 : 'Power PC 601', 0x22 : 'Power PC 603',
+    0x23 : 'Power PC 603+', 0x24 : 'Power PC 604', 0x25 : 'Power PC 620',
+    0x26 : 'Power PC x704', 0x27 : 'Power PC 750', 0x28 : 'Core Duo',
+    0x29 : 'Core Duo Mobile', 0x2A : 'Core Solo Mobile', 0x2B : 'Atom',
+    0x2C : 'Core M', 0x2D : 'Core m3', 0x2E : 'Core m5', 0x2F : 'Core m7',
+    0x30 : 'Alpha', 0x31 : 'Alpha 21064', 0x32 : 'Alpha 21066',
+    0x33 : 'Alpha 21164', 0x34 : 'Alpha 21164PC', 0x35 : 'Alpha 21164a',
+    0x36 : 'Alpha 21264', 0x37 : 'Alpha 21364',
+    0x38 : 'Turion II Ultra Dual-Core Mobile M',
+    0x39 : 'Turion II Dual-Core Mobile M', 0x3A : 'Athlon II Dual-Core M',
+    0x3B : 'Opteron 6100', 0x3C : 'Opteron 4100', 0x3D : 'Opteron 6200',
+    0x3E : 'Opteron 4200', 0x3F : 'FX',
+    0x40 : 'MIPS', 0x41 : 'MIPS R4000', 0x42 : 'MIPS R4200',
+    0x43 : 'MIPS R4400', 0x44 : 'MIPS R4600', 0x45 : 'MIPS R10000',
+    0x46 : 'C-Series', 0x47 : 'E-Series', 0x48 : 'A-Series',
+    0x49 : 'G-Series', 0x4A : 'Z-Series', 0x4B : 'R-Series',
+    0x4C : 'Opteron 4300', 0x4D : 'Opteron 6300', 0x4E : 'Opteron 3300',
+    0x4F : 'FirePro',
+    0x50 : 'SPARC', 0x51 : 'SuperSPARC', 0x52 : 'MicroSPARC II',
+    0x53 : 'MicroSPARC IIep', 0x54 : 'UltraSPARC', 0x55 : 'UltraSPARC II',
+    0x56 : 'UltraSPARC IIi', 0x57 : 'UltraSPARC III',
+    0x58 : 'UltraSPARC IIIi',
+    0x60 : '68040', 0x61 : '68xxx', 0x62 : '68000', 0x63 : '68010',
+    0x64 : '68020', 0x65 : '68030', 0x66 : 'Athlon X4',
+    0x67 : 'Opteron X1000', 0x68 : 'Opteron X2000',
+    0x69 : 'Opteron A-Series', 0x6A : 'Opteron X3000', 0x6B : 'Zen',
+    0x70 : 'Hobbit', 0x78 : 'Crusoe TM5000', 0x79 : 'Crusoe TM3000',
+    0x7A : 'Efficeon TM8000',
+    0x80 : 'Weitek', 0x82 : 'Itanium', 0x83 : 'Athlon 64', 0x84 : 'Opteron',
+    0x85 : 'Sempron', 0x86 : 'Turion 64', 0x87 : 'Dual-Core Opteron',
+    0x88 : 'Athlon 64 X2', 0x89 : 'Turion 64 X2',
+    0x8A : 'Quad-Core Opteron', 0x8B : 'Third-Generation Opteron',
+    0x8C : 'Phenom FX', 0x8D : 'Phenom X4', 0x8E : 'Phenom X2',
+    0x8F : 'Athlon X2',
+    0x90 : 'PA-RISC', 0x91 : 'PA-RISC 8500', 0x92 : 'PA-RISC 8000',
+    0x93 : 'PA-RISC 7300LC', 0x94 : 'PA-RISC 7200', 0x95 : 'PA-RISC 7100LC',
+    0x96 : 'PA-RISC 7100',
+    0xA0 : 'V30', 0xA1 : 'Quad-Core Xeon 3200', 0xA2 : 'Dual-Core Xeon 3000',
+    0xA3 : 'Quad-Core Xeon 5300', 0xA4 : 'Dual-Core Xeon 5100',
+    0xA5 : 'Dual-Core Xeon 5000', 0xA6 : 'Dual-Core Xeon LV',
+    0xA7 : 'Dual-Core Xeon ULV', 0xA8 : 'Dual-Core Xeon 7100',
+    0xA9 : 'Quad-Core Xeon 5400', 0xAA : 'Quad-Core Xeon',
+    0xAB : 'Dual-Core Xeon 5200', 0xAC : 'Dual-Core Xeon 7200',
+    0xAD : 'Quad-Core Xeon 7300', 0xAE : 'Quad-Core Xeon 7400',
+    0xAF : 'Multi-Core Xeon 7400',
+    0xB0 : 'Pentium III Xeon', 0xB1 : 'Pentium III Speedstep',
+    0xB2 : 'Pentium 4', 0xB3 : 'Xeon', 0xB4 : 'AS400', 0xB5 : 'Xeon MP',
+    0xB6 : 'Athlon XP', 0xB7 : 'Athlon MP', 0xB8 : 'Itanium 2',
+    0xB9 : 'Pentium M', 0xBA : 'Celeron D', 0xBB : 'Pentium D',
+    0xBC : 'Pentium EE', 0xBD : 'Core Solo', 0xBF : 'Core 2 Duo',
+    0xC0 : 'Core 2 Solo', 0xC1 : 'Core 2 Extreme', 0xC2 : 'Core 2 Quad',
+    0xC3 : 'Core 2 Extreme Mobile', 0xC4 : 'Core 2 Duo Mobile',
+    0xC5 : 'Core 2 Solo Mobile', 0xC6 : 'Core i7',
+    0xC7 : 'Dual-Core Celeron', 0xC8 : 'IBM390', 0xC9 : 'G4', 0xCA : 'G5',
+    0xCB : 'ESA/390 G6', 0xCC : 'z/Architecture', 0xCD : 'Core i5',
+    0xCE : 'Core i3', 0xCF : 'Core i9',
+    0xD2 : 'C7-M', 0xD3 : 'C7-D', 0xD4 : 'C7', 0xD5 : 'Eden',
+    0xD6 : 'Multi-Core Xeon', 0xD7 : 'Dual-Core Xeon 3xxx',
+    0xD8 : 'Quad-Core Xeon 3xxx', 0xD9 : 'Nano',
+    0xDA : 'Dual-Core Xeon 5xxx', 0xDB : 'Quad-Core Xeon 5xxx',
+    0xDD : 'Dual-Core Xeon 7xxx', 0xDE : 'Quad-Core Xeon 7xxx',
+    0xDF : 'Multi-Core Xeon 7xxx', 0xE0 : 'Multi-Core Xeon 3400',
+    0xE4 : 'Opteron 3000', 0xE5 : 'Sempron II',
+    0xE6 : 'Embedded Opteron Quad-Core', 0xE7 : 'Phenom Triple-Core',
+    0xE8 : 'Turion Ultra Dual-Core Mobile', 0xE9 : 'Turion Dual-Core Mobile',
+    0xEA : 'Athlon Dual-Core', 0xEB : 'Sempron SI', 0xEC : 'Phenom II',
+    0xED : 'Athlon II', 0xEE : 'Six-Core Opteron', 0xEF : 'Sempron M',
+    0xFA : 'i860', 0xFB : 'i960',
+    0x100 : 'ARMv7', 0x101 : 'ARMv8', 0x104 : 'SH-3', 0x105 : 'SH-4',
+    0x118 : 'ARM', 0x119 : 'StrongARM', 0x12C : '6x86', 0x12D : 'MediaGX',
+    0x12E : 'MII', 0x140 : 'WinChip', 0x15E : 'DSP',
+    0x1F4 : 'Video Processor', 0x200 : 'RV32', 0x201 : 'RV64',
+    0x202 : 'RV128',
+}
+
+MEMORY_UNITS = ('kB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB')
+
+
+def available(tables_dir=TABLES_DIR):
+    return os.access(os.path.join(tables_dir, 'DMI'), os.R_OK)
+
+
+def read_tables(tables_dir=TABLES_DIR):
+    with open(os.path.join(tables_dir, 'smbios_entry_point'), 'rb') as f:
+        entry_point = f.read()
+    with open(os.path.join(tables_dir, 'DMI'), 'rb') as f:
+        table = f.read()
+    return decode(entry_point, table)
+
+
+def smbios_version(entry_point):
+    if entry_point.startswith(b'_SM3_'):
+        return entry_point[7], entry_point[8]
+    elif entry_point.startswith(b'_SM_'):
+        return entry_point[6], entry_point[7]
+    raise ValueError('Unknown SMBIOS entry point')
+
+
+def iter_structures(table):
+    """
+    Yield (type, formatted area, strings) for every structure in the table.
+    """
+    pos = 0
+    while pos + 4 <= len(table):
+        typ, length = table[pos], table[pos + 1]
+        if length < 4:
+            break
+        formatted = table[pos:pos + length]
+        end = table.find(b'\0\0', pos + length)
+        if end < 0:
+            break
+        strings = [s.decode('ascii', 'replace').strip() for s in
+            table[pos + length:end].split(b'\0')]
+        yield typ, formatted, strings
+        if typ == END_OF_TABLE:
+            break
+        pos = end + 2
+
+
+class Structure():
+    def __init__(self, formatted, strings):
+        self.data = formatted
+        self.strings = strings
+
+    def has(self, offset, size=1):
+        return len(self.data) >= offset + size
+
+    def byte(self, offset):
+        return self.data[offset] if self.has(offset) else None
+
+    def word(self, offset):
+        if not self.has(offset, 2): return None
+        return struct.unpack_from('<H', self.data, offset)[0]
+
+    def dword(self, offset):
+        if not self.has(offset, 4): return None
+        return struct.unpack_from('<I', self.data, offset)[0]
+
+    def string(self, offset):
+        index = self.byte(offset)
+        if index == None or index == 0:
+            return 'Not Specified'
+        elif index > len(self.strings):
+            return '<BAD INDEX>'
+        return self.strings[index - 1]
+
+
+def decode_bios(s, version):
+    return {'Vendor' : s.string(0x04), 'Version' : s.string(0x05),
+    'Release Date' : s.string(0x08)}
+
+
+def decode_uuid(raw, version):
+    if raw == b'\xff' * 16: return 'Not Present'
+    elif raw == b'\0' * 16: return 'Not Settable'
+    # Since SMBIOS 2.6 the first three fields are little-endian
+    if version >= (2, 6):
+        raw = raw[3::-1] + raw[5:3:-1] + raw[7:5:-1] + raw[8:]
+    # dmidecode 3 prints every version in lower case
+    h = raw.hex()
+    return '{0}-{1}-{2}-{3}-{4}'.format(h[:8], h[8:12], h[12:16], h[16:20],
+        h[20:])
+
+
+def decode_system(s, version):
+    info = {'Manufacturer' : s.string(0x04), 'Product Name' : s.string(0x05),
+    'Version' : s.string(0x06), 'Serial Number' : s.string(0x07)}
+    if s.has(0x08, 16):
+        info['UUID'] = decode_uuid(bytes(s.data[0x08:0x18]), version)
+    if s.has(0x1A):
+        info['SKU Number'] = s.string(0x19)
+        info['Family'] = s.string(0x1A)
+    return info
+
+
+def decode_chassis(s, version):
+    info = {'Manufacturer' : s.string(0x04), 'Version' : s.string(0x06),
+    'Serial Number' : s.string(0x07), 'Asset Tag' : s.string(0x08),
+    'Height' : 'Unspecified'}
+    if s.has(0x11) and s.byte(0x11) != 0:
+        info['Height'] = '{} U'.format(s.byte(0x11))
+    return info
+
+
+def processor_family(family, manufacturer):
+    # Codes assigned twice by the specification
+    if family == 0x30 and manufacturer.startswith('Intel'):
+        return 'Pentium Pro'
+    elif family == 0xBE:
+        if manufacturer.startswith('Intel'):
+            return 'Core 2'
+        elif manufacturer.startswith('AMD'):
+            return 'K7'
+        return 'Core 2 or K7'
+    return PROCESSOR_FAMILIES.get(family, '<OUT OF SPEC>')
+
+
+def decode_processor(s, version):
+    family = s.byte(0x06)
+    if family == 0xFE and s.has(0x28, 2):
+        family = s.word(0x28)
+    manufacturer = s.string(0x07)
+    max_speed = s.word(0x14)
+
+    info = {'Socket Designation' : s.string(0x04),
+    'Family' : processor_family(family, manufacturer),
+    'Manufacturer' : manufacturer, 'Version' : s.string(0x10),
+    'Max Speed' : '{} MHz'.format(max_speed) if max_speed else 'Unknown'}
+
+    if s.has(0x23):
+        core_count = s.byte(0x23)
+        if core_count == 0xFF and s.has(0x2A, 2):
+            core_count = s.word(0x2A)
+        info['Core Count'] = str(core_count)
+    if s.has(0x25):
+        thread_count = s.byte(0x25)
+        if thread_count == 0xFF and s.has(0x2E, 2):
+            thread_count = s.word(0x2E)
+        info['Thread Count'] = str(thread_count)
+    return info
+
+
+def memory_size(kb):
+    """
+    A size in kB the way dmidecode prints it: in the largest unit, or the
+    one below when that leaves a remainder (1536 MB, 32 GB).
+    """
+    chunks = []
+    while kb:
+        chunks.append(kb & 0x3FF)
+        kb >>= 10
+    if not chunks:
+        return '0 kB'
+    unit = len(chunks) - 1
+    if unit > 0 and chunks[unit - 1]:
+        unit -= 1
+        return '{0} {1}'.format(chunks[unit] + (chunks[unit + 1] << 10),
+            MEMORY_UNITS[unit])
+    return '{0} {1}'.format(chunks[unit], MEMORY_UNITS[unit])
+
+
+def decode_memory_device(s, version):
+    size = s.word(0x0C)
+    if size == 0:
+        size_str = 'No Module Installed'
+    elif size == 0xFFFF or size == None:
+        size_str = 'Unknown'
+    elif size == 0x7FFF and s.has(0x1C, 4):
+        size_str = memory_size((s.dword(0x1C) & 0x7FFFFFFF) << 10)
+    elif size & 0x8000:
+        size_str = memory_size(size & 0x7FFF)
+    else:
+        size_str = memory_size(size << 10)
+
+    info = {'Size' : size_str, 'Locator' : s.string(0x10),
+    'Bank Locator' : s.string(0x11)}
+    if s.has(0x1B):
+        info['Manufacturer'] = s.string(0x17)
+        info['Serial Number'] = s.string(0x18)
+        info['Part Number'] = s.string(0x1A)
+    return info
+
+
+DECODERS = {0 : decode_bios, 1 : decode_system, 3 : decode_chassis,
+    4 : decode_processor, 17 : decode_memory_device}
+
+
+def decode(entry_point, table):
+    version = smbios_version(entry_point)
+    info = []
+    for typ, formatted, strings in iter_structures(table):
+        if typ not in DECODERS:
+            continue
+        data = DECODERS[typ](Structure(formatted, strings), version)
+        data['_title'] = TITLES[typ][1]
+        info.append((TITLES[typ][0], data))
+    return info
@@ -0,0 +1,187 @@
+"""
+Host discovery for the agent, either live on this machine (LocalHost) or
+replayed from a JSON snapshot collected earlier (SnapshotHost), so NetBox
+can be updated from a different machine than the one discovered.
+"""
+import json
+import logging
+import platform
+import socket
+
+import netaddr
+import netifaces
+
+import dmidecode
+import sysfs_hw
+
+SNAPSHOT_VERSION = 1
+
+# Address families are stored by name, their numbers differ between OSes
+FAMILIES = {'inet' : netifaces.AF_INET, 'inet6' : netifaces.AF_INET6}
+
+
+class LocalHost():
+    """
+    Discovers this machine: hostname, DMI profile, interfaces and
+    addresses, module form factors and PCI/CPU hardware.
+    """
+    def __init__(self, sysfs_root='/', dmi_cache=None):
+        self.system = platform.system()
+        self.sysfs_root = sysfs_root
+        self.dmi_cache = dmi_cache
+
+    def hostname(self):
+        return socket.gethostname()
+
+    def placement(self):
+        """
+        Rack position, face, manufacturer, model name and height options
+        of this host, or None to use the agent's configuration.
+        """
+        return None
+
+    def dmi_profile(self):
+        return dmidecode.profile(cache_file=self.dmi_cache)
+
+    def interfaces(self):
+        """
+        (links, addrs): a netlink_tables.LinkTable (None outside Linux) and
+        an object with the netifaces interfaces/ifaddresses/gateways API.
+        """
+        if self.system != 'Linux':
+            return None, netifaces
+        import netlink_tables
+        links = netlink_tables.LinkTable.dump()
+        return links, netlink_tables.AddressTable.dump(links)
+
+    def formfactor_id(self, ifname):
+        import ethtool
+        return ethtool.get_formfactor_id(ifname, self.sysfs_root)
+
+    def hw(self, device_id):
+        """
+        Inventory items for update_hw, or None where hardware discovery is
+        not supported.
+        """
+        if self.system != 'Linux':
+            return None
+        elif sysfs_hw.available(self.sysfs_root):
+            return sysfs_hw.get_hw(device_id, self.sysfs_root)
+
+        import lshw
+        hws = lshw.get_hw_linux_json(device_id)
+        # Only physical NICs have a product name
+        return [d for d in hws if d['class'] != 'network' or 'product' in d]
+
+
+class SnapshotHost():
+    """
+    Replays the discovery results stored in a snapshot.
+    """
+    def __init__(self, snap):
+        self.snap = snap
+        self.system = snap['system']
+
+    def hostname(self):
+        return self.snap['hostname']
+
+    def placement(self):
+        # The configuration of the pushing machine describes another host
+        return self.snap.get('placement', {})
+
+    def dmi_profile(self):
+        return dmidecode.DMIProfile(tuple(item) for item in self.snap['dmi'])
+
+    def interfaces(self):
+        import netlink_tables
+        links = netlink_tables.LinkTable(netlink_tables.Link(*link)
+            for link in self.snap['links'])
+        addresses = [(index, FAMILIES[family], {'addr' : addr,
+            'netmask' : str(prefixlen), 'prefixlen' : prefixlen})
+            for index, family, addr, prefixlen in self.snap['addresses']]
+        routes = [(FAMILIES[family], 0, links.by_name[ifname].index, gateway)
+            for family, gateway, ifname in self.snap['gateways']
+            if ifname in links.by_name]
+        return links, netlink_tables.AddressTable(links, addresses, routes)
+
+    def formfactor_id(self, ifname):
+        return self.snap['formfactors'].get(ifname, 0)
+
+    def hw(self, device_id):
+        if self.snap['hw'] == None:
+            return None
+        return [dict(hw, **{'bus info' : '{0}@{1}'.format(device_id,
+            hw['bus info'])}) for hw in self.snap['hw']]
+
+
+def collect_links(links, addrs):
+    if links != None:
+        return [list(link) for link in links.by_name.values()]
+
+    collected = []
+    for index, name in enumerate(addrs.interfaces(), 1):
+        mac = addrs.ifaddresses(name).get(netifaces.AF_LINK, [{}])[0].get(
+            'addr') or None
+        collected.append([index, name, None, None, None, None, mac])
+    return collected
+
+
+def collect_addresses(links, addrs):
+    collected = []
+    for index, name, *_ in links:
+        ifaddrs = addrs.ifaddresses(name)
+        for family, family_id in FAMILIES.items():
+            for adr in ifaddrs.get(family_id, []):
+                address = adr['addr'].split('%')[0]
+                prefixlen = netaddr.IPNetwork('{0}/{1}'.format(address,
+                    adr['netmask'].split('/')[-1])).prefixlen
+                collected.append([index, family, address, prefixlen])
+    return collected
+
+
+def collect(host, placement=None):
+    """
+    Run every discovery step on host and return the results as a
+    JSON-serializable snapshot. placement holds the host's own rack
+    position, face, manufacturer, model name and height options, if any.
+    """
+    logging.debug('Collecting snapshot of ' + host.hostname())
+    links, addrs = host.interfaces()
+    snap_links = collect_links(links, addrs)
+    gateways = addrs.gateways()['default']
+
+    formfactors = {}
+    if host.system == 'Linux':
+        for name in links.by_name:
+            if links.phy_int(name) == name:
+                formfactors[name] = host.formfactor_id(name)
+
+    # The device ID part of bus info is only known when pushing
+    hws = host.hw(0)
+    if hws != None:
+        hws = [dict(hw, **{'bus info' : hw['bus info'].split('@', 1)[1]})
+            for hw in hws]
+
+    return {'version' : SNAPSHOT_VERSION, 'hostname' : host.hostname(),
+        'system' : host.system, 'dmi' : list(host.dmi_profile()),
+        'links' : snap_links,
+        'addresses' : collect_addresses(snap_links, addrs),
+        'gateways' : [[family, gateways[family_id][0], gateways[family_id][1]]
+            for family, family_id in FAMILIES.items()
+            if family_id in gateways],
+        'formfactors' : formfactors, 'hw' : hws,
+        'placement' : dict(placement or {})}
+
+
+def save(snap, path):
+    with open(path, 'w') as snap_file:
+        json.dump(snap, snap_file, separators=(',', ':'))
+
+
+def load(path):
+    with open(path) as snap_file:
+        snap = json.load(snap_file)
+    if snap.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version {0} in {1}'.format(
+            snap.get('version'), path))
+    return snap
@@ -0,0 +1,183 @@
+import glob
+import os
+
+import timing
+
+PCI_IDS_PATHS = ['usr/share/hwdata/pci.ids', 'usr/share/misc/pci.ids',
+    'usr/share/pci.ids']
+
+# PCI base classes reported by lshw -class network / -class storage
+PCI_CLASSES = {0x01 : 'storage', 0x02 : 'network'}
+
+# lshw describes these differently from the pci.ids subclass names
+DESCRIPTIONS = {0x0200 : 'Ethernet interface', 0x0280 : 'Network controller'}
+
+
+def read_attr(path):
+    try:
+        with open(path) as attr:
+            return attr.read().strip()
+    except OSError:
+        return None
+
+
+def available(root='/'):
+    return os.path.isdir(os.path.join(root, 'sys/bus/pci/devices'))
+
+
+def load_pci_ids(root, vendors):
+    """
+    Parse the pci.ids database, keeping device names only for the given
+    vendor IDs. Returns (vendor names, device names, subclass names), keyed
+    by int IDs.
+    """
+    vendor_names, device_names, class_names = {}, {}, {}
+    path = next((os.path.join(root, p) for p in PCI_IDS_PATHS
+        if os.path.exists(os.path.join(root, p))), None)
+    if path == None:
+        return vendor_names, device_names, class_names
+
+    vendor = base_class = None
+    with open(path, encoding='utf-8', errors='replace') as ids:
+        for line in ids:
+            if line.startswith('#') or line.strip() == '':
+                continue
+            elif line.startswith('C '):
+                vendor = None
+                base_class = int(line[2:4], 16)
+            elif not line.startswith('\t'):
+                base_class = None
+                vendor = int(line[:4], 16)
+                if vendor in vendors:
+                    vendor_names[vendor] = line[4:].strip()
+            elif line.startswith('\t\t'):
+                continue
+            elif vendor in vendors:
+                device_names[(vendor, int(line[1:5], 16))] = line[5:].strip()
+            elif base_class != None:
+                subclass = int(line[1:3], 16)
+                class_names[(base_class << 8) | subclass] = line[3:].strip()
+    return vendor_names, device_names, class_names
+
+
+def nvme_models(root):
+    models = {}
+    for ctrl in glob.glob(os.path.join(root, 'sys/class/nvme/nvme*')):
+        model = read_attr(os.path.join(ctrl, 'model'))
+        pci_addr = os.path.basename(os.path.realpath(os.path.join(ctrl,
+            'device')))
+        if model != None:
+            models[pci_addr] = model
+    return models
+
+
+def get_pci_devices(device_id, root='/', addresses=None):
+    """
+    Network and storage PCI devices in the same form as
+    lshw.get_hw_linux('network'/'storage'). If addresses is given, only
+    those PCI addresses are read.
+    """
+    pci_root = os.path.join(root, 'sys/bus/pci/devices')
+    if addresses == None:
+        addresses = sorted(os.listdir(pci_root))
+
+    found = []
+    for addr in addresses:
+        dev_path = os.path.join(pci_root, addr)
+        pci_class = read_attr(os.path.join(dev_path, 'class'))
+        if pci_class == None or int(pci_class, 16) >> 16 not in PCI_CLASSES:
+            continue
+        found.append((addr, dev_path, int(pci_class, 16) >> 8,
+            int(read_attr(os.path.join(dev_path, 'vendor')), 16),
+            int(read_attr(os.path.join(dev_path, 'device')), 16)))
+    if len(found) == 0:
+        return []
+
+    vendor_names, device_names, class_names = load_pci_ids(root,
+        set(d[3] for d in found))
+    models = nvme_models(root)
+
+    HWs = []
+    for addr, dev_path, subclass, vendor, device in found:
+        HW = {'bus info' : '{0}@pci@{1}'.format(device_id, addr),
+        'class' : PCI_CLASSES[subclass >> 8]}
+        HW['description'] = DESCRIPTIONS.get(subclass, class_names.get(
+            subclass, HW['class'].capitalize() + ' controller'))
+        HW['vendor'] = vendor_names.get(vendor, '{:04x}'.format(vendor))
+        HW['product'] = device_names.get((vendor, device),
+            'Device {:04x}'.format(device))
+        if addr in models:
+            HW['product'] = models[addr]
+
+        ifnames = glob.glob(os.path.join(dev_path, 'net', '*'))
+        if len(ifnames) > 0:
+            HW['logical name'] = os.path.basename(ifnames[0])
+        HWs.append(HW)
+    return HWs
+
+
+def read_cpuinfo(root):
+    """
+    (per-processor fields, fields outside of any processor block) of
+    /proc/cpuinfo.
+    """
+    processors, machine, block = [], {}, {}
+    with open(os.path.join(root, 'proc/cpuinfo')) as cpuinfo:
+        for line in cpuinfo.read().splitlines() + ['']:
+            if line.strip() == '':
+                if block.get('processor', '').isdigit():
+                    processors.append(block)
+                else:
+                    # 32-bit ARM has Processor and Hardware lines of its own
+                    machine.update(block)
+                block = {}
+                continue
+            key, _, value = line.partition(':')
+            block[key.strip()] = value.strip()
+    return processors, machine
+
+
+def cpu_socket(processor, root):
+    """Socket of a processor block, from cpuinfo or the sysfs topology."""
+    if 'physical id' in processor:
+        return processor['physical id']
+    package = read_attr(os.path.join(root, 'sys/devices/system/cpu',
+        'cpu' + processor['processor'], 'topology/physical_package_id'))
+    # ARM firmware without socket information reports -1
+    if package == None or not package.isdigit():
+        return '0'
+    return package
+
+
+def cpu_model(processor, machine):
+    # ARM and some hypervisors have no model name
+    if 'model name' in processor:
+        return processor['model name']
+    for key in ('Processor', 'Hardware'):
+        if key in machine:
+            return machine[key]
+    if 'CPU part' in processor:
+        return 'CPU implementer {0} part {1}'.format(processor.get(
+            'CPU implementer', 'unknown'), processor['CPU part'])
+    return 'Unknown'
+
+
+def get_cpus(device_id, root='/'):
+    """
+    One entry per CPU socket, in the same form as lshw.get_hw_linux('cpu').
+    """
+    processors, machine = read_cpuinfo(root)
+    sockets = {}
+    for processor in processors:
+        sockets.setdefault(cpu_socket(processor, root), cpu_model(processor,
+            machine))
+
+    return [{'bus info' : '{0}@cpu@{1}'.format(device_id, socket_id),
+        'product' : sockets[socket_id], 'class' : 'cpu',
+        'description' : 'Central Processing Unit'}
+        for socket_id in sorted(sockets, key=int)]
+
+
+@timing.timed('sysfs hw')
+def get_hw(device_id, root='/'):
+    return get_cpus(device_id, root) + get_pci_devices(device_id, root)
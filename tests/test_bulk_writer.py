@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import bulk_writer
+
+
+def response(status_code, body=None, reason=''):
+    text = json.dumps(body) if body is not None else ''
+    return mock.Mock(status_code=status_code, text=text, reason=reason)
+
+
+class BulkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.url.side_effect = lambda obj_name: '/api/' + obj_name
+        self.client.decode.side_effect = lambda resp: json.loads(resp.text)
+        self.writer = bulk_writer.BulkWriter(self.client)
+
+    def sent(self):
+        return [(call[0][0], call[1]['json'])
+            for call in self.client.request.call_args_list]
+
+    def test_partial_failure(self):
+        # NetBox rejects the list for one item: the others are sent again
+        # on their own and the rejected one is reported
+        self.client.request.side_effect = [
+            response(400, [{}, {'name' : ['already exists']}, {}]),
+            response(201, [{'id' : 1, 'name' : 'eth0'},
+                {'id' : 3, 'name' : 'eth2'}])]
+        created = []
+        for name in ('eth0', 'eth1', 'eth2'):
+            self.writer.create('interfaces', {'name' : name},
+                callback=created.append)
+        with self.assertRaises(bulk_writer.BulkWriteError) as cm:
+            self.writer.flush()
+        self.assertEqual(cm.exception.errors, [('eth1', 'POST', 'interfaces',
+            {'name' : ['already exists']})])
+        self.assertEqual(self.sent()[1], ('POST', [{'name' : 'eth0'},
+            {'name' : 'eth2'}]))
+        self.assertEqual([obj['id'] for obj in created], [1, 3])
+
+    def test_failure_without_details(self):
+        self.client.request.return_value = response(500, reason='Server Error')
+        self.writer.delete('interfaces', 4)
+        self.writer.delete('interfaces', 5)
+        with self.assertRaises(bulk_writer.BulkWriteError) as cm:
+            self.writer.flush()
+        self.assertEqual([e[0] for e in cm.exception.errors], [4, 5])
+        self.assertEqual(self.client.request.call_count, 1)
+
+    def test_failure_drops_queued_writes(self):
+        self.client.request.side_effect = [ConnectionError,
+            response(201, [{'id' : 2}])]
+        self.writer.create('interfaces', {'name' : 'eth0'}, callback=lambda
+            obj: self.writer.create('ip-addresses', {'address' : '::1/128'}))
+        self.writer.update('interfaces', 7, {'mtu' : 9000})
+        with self.assertRaises(ConnectionError):
+            self.writer.flush()
+        self.writer.create('interfaces', {'name' : 'eth1'})
+        self.writer.flush()
+        self.assertEqual(self.sent()[1], ('POST', [{'name' : 'eth1'}]))
+
+    def test_merged_updates(self):
+        # Updates of one object are merged into a single PATCH, sent after
+        # the creations queued with them
+        self.client.request.side_effect = [response(201, [{'id' : 9}]),
+            response(200, [{'id' : 7, 'mtu' : 9000, 'enabled' : False},
+                {'id' : 8, 'mtu' : 1500}])]
+        results = []
+        self.writer.update('interfaces', 7, {'mtu' : 1500},
+            callback=results.append)
+        self.writer.update('interfaces', 8, {'mtu' : 1500})
+        self.writer.create('interfaces', {'name' : 'eth0'})
+        self.writer.update('interfaces', 7, {'mtu' : 9000, 'enabled' : False},
+            callback=results.append)
+        self.writer.flush()
+        self.assertEqual(self.sent(), [('POST', [{'name' : 'eth0'}]),
+            ('PATCH', [{'id' : 7, 'mtu' : 9000, 'enabled' : False},
+                {'id' : 8, 'mtu' : 1500}])])
+        self.assertEqual(results, [{'id' : 7, 'mtu' : 9000,
+            'enabled' : False}] * 2)
+
+    def test_callbacks_queue_next_round(self):
+        self.client.request.side_effect = [response(201, [{'id' : 5}]),
+            response(201, [{'id' : 6}])]
+        self.writer.create('interfaces', {'name' : 'eth0'},
+            callback=lambda obj: self.writer.create('ip-addresses',
+            {'address' : '10.0.0.1/24', 'assigned_object_id' : obj['id']}))
+        self.writer.flush()
+        self.assertEqual(self.sent()[1], ('POST', [{'address' : '10.0.0.1/24',
+            'assigned_object_id' : 5}]))
+
+    def test_chunks(self):
+        self.writer.chunk_size = 2
+        self.client.request.side_effect = [response(204), response(204)]
+        for id in range(3):
+            self.writer.delete('interfaces', id)
+        self.writer.flush()
+        self.assertEqual(self.sent(), [('DELETE', [{'id' : 0}, {'id' : 1}]),
+            ('DELETE', [{'id' : 2}])])
+
+
+if __name__ == '__main__':
+    unittest.main()
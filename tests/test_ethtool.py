@@ -0,0 +1,104 @@
+import errno
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ethtool
+
+
+class Reply():
+    def __init__(self, data):
+        self.data = data
+
+    def get_attr(self, name):
+        assert name == 'ETHTOOL_A_MODULE_EEPROM_DATA'
+        return self.data
+
+
+@unittest.skipIf(ethtool.GenericNetlinkSocket is None,
+    'pyroute2 generic netlink is not available')
+class ModuleIdentifierTest(unittest.TestCase):
+    def socket(self, replies):
+        with mock.patch.object(ethtool.GenericNetlinkSocket, '__init__',
+            lambda self: None), mock.patch.object(ethtool.EthtoolSocket,
+            'bind'):
+            sock = ethtool.EthtoolSocket()
+        sock.prid = 20
+        # pyroute2 0.5 returns replies as a generator
+        sock.nlm_request = mock.Mock(return_value=(r for r in replies))
+        return sock
+
+    def test_identifier(self):
+        sock = self.socket([Reply(b'\x11')])
+        self.assertEqual(sock.get_module_identifier('ens1f0'), 0x11)
+        msg = sock.nlm_request.call_args[0][0]
+        self.assertEqual(msg['cmd'], ethtool.ETHTOOL_MSG_MODULE_EEPROM_GET)
+
+    def test_no_data(self):
+        self.assertIsNone(self.socket([Reply(None)]).get_module_identifier(
+            'ens1f0'))
+        self.assertIsNone(self.socket([]).get_module_identifier('ens1f0'))
+
+    def test_form_factor(self):
+        sock = self.socket([Reply(b'\x11')])
+        with mock.patch.object(ethtool, 'ethtool_socket', sock):
+            self.assertEqual(ethtool.read_form_factor('ens1f0'), 'QSFP28')
+
+
+    def test_unsupported_kernel_is_cached(self):
+        error = ethtool.NetlinkError(errno.EOPNOTSUPP)
+        sock = self.socket([])
+        sock.get_module_identifier = mock.Mock(side_effect=error)
+        with mock.patch.object(ethtool, 'ethtool_socket', sock), \
+            mock.patch.object(ethtool, 'netlink_error', None):
+            for _ in range(3):
+                self.assertRaises(ethtool.NetlinkError,
+                    ethtool.read_form_factor, 'ens1f0')
+        self.assertEqual(sock.get_module_identifier.call_count, 1)
+
+    def test_bind_failure_closes_socket(self):
+        with mock.patch.object(ethtool.GenericNetlinkSocket, '__init__',
+            lambda self: None), mock.patch.object(ethtool.EthtoolSocket,
+            'bind', side_effect=ethtool.NetlinkError(errno.ENOENT)), \
+            mock.patch.object(ethtool.EthtoolSocket, 'close') as close, \
+            mock.patch.object(ethtool, 'ethtool_socket', None), \
+            mock.patch.object(ethtool, 'netlink_error', None):
+            for _ in range(3):
+                self.assertRaises(ethtool.NetlinkError,
+                    ethtool.read_form_factor, 'ens1f0')
+            self.assertEqual(close.call_count, 1)
+
+
+class ProbeTest(unittest.TestCase):
+    def test_fallback_on_netlink_error(self):
+        with mock.patch.object(ethtool, 'read_speed', return_value=25000), \
+            mock.patch.object(ethtool, 'read_form_factor',
+            side_effect=NotImplementedError), mock.patch.object(ethtool,
+            'get_form_factor', return_value='SFP'):
+            self.assertEqual(ethtool.probe('ens1f0'), (25000, 'SFP'))
+
+    def test_bugs_are_raised(self):
+        with mock.patch.object(ethtool, 'read_speed', return_value=25000), \
+            mock.patch.object(ethtool, 'read_form_factor',
+            side_effect=TypeError):
+            self.assertRaises(TypeError, ethtool.probe, 'ens1f0')
+
+    def test_sysfs_root(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'sys/class/net/ens1f0'))
+            with open(os.path.join(root, 'sys/class/net/ens1f0/speed'),
+                'w') as speed_file:
+                speed_file.write('25000\n')
+            with mock.patch.object(ethtool, 'read_form_factor',
+                return_value='SFP'):
+                self.assertEqual(ethtool.probe('ens1f0', root),
+                    (25000, 'SFP'))
+
+
+if __name__ == '__main__':
+    unittest.main()
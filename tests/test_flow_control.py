@@ -0,0 +1,94 @@
+import email.utils
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import flow_control
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(flow_control.retry_after('120'), 120.0)
+        self.assertEqual(flow_control.retry_after('0.5'), 0.5)
+        self.assertEqual(flow_control.retry_after('-3'), 0.0)
+        self.assertEqual(flow_control.retry_after('86400'),
+            flow_control.MAX_RETRY_AFTER)
+
+    def test_date(self):
+        date = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(flow_control.retry_after(date), 60, delta=2)
+        past = email.utils.formatdate(time.time() - 60, usegmt=True)
+        self.assertEqual(flow_control.retry_after(past), 0.0)
+
+    def test_invalid(self):
+        self.assertIsNone(flow_control.retry_after(None))
+        self.assertIsNone(flow_control.retry_after(''))
+        self.assertIsNone(flow_control.retry_after('soon'))
+
+
+class ShouldRetryTest(unittest.TestCase):
+    def test_statuses(self):
+        for method in ('GET', 'POST', 'PATCH', 'DELETE'):
+            self.assertTrue(flow_control.should_retry(method, 429))
+            self.assertTrue(flow_control.should_retry(method, 503))
+            self.assertFalse(flow_control.should_retry(method, 500))
+        # A 502/504 may come after the write was done
+        self.assertTrue(flow_control.should_retry('GET', 502))
+        self.assertTrue(flow_control.should_retry('HEAD', 504))
+        self.assertFalse(flow_control.should_retry('POST', 502))
+        self.assertFalse(flow_control.should_retry('PATCH', 504))
+
+
+class AIMDLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('flow_control.time.monotonic',
+            lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = flow_control.AIMDLimiter(8, min_limit=2)
+
+    def request(self, latency, overloaded=False, key=None):
+        self.limiter.acquire()
+        self.limiter.release(latency, overloaded, key)
+
+    def test_decrease(self):
+        self.request(0.1, overloaded=True)
+        self.assertEqual(self.limiter.limit, 4)
+        # Requests sent before the decrease took effect do not count
+        self.now += 0.05
+        self.request(0.1, overloaded=True)
+        self.assertEqual(self.limiter.limit, 4)
+        self.now += 0.1
+        self.request(0.1, overloaded=True)
+        self.assertEqual(self.limiter.limit, 2)
+        self.now += 1
+        self.request(0.1, overloaded=True)
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_latency_decrease(self):
+        self.request(0.01, key='GET')
+        self.request(1.0, key='POST')
+        self.assertEqual(self.limiter.limit, 8)
+        self.request(0.1, key='GET')
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_recovery(self):
+        self.request(0.1, overloaded=True)
+        self.request(0.1, overloaded=True)
+        self.assertEqual(self.limiter.limit, 4)
+        self.request(0.1)
+        self.assertEqual(self.limiter.limit, 4.25)
+        for _ in range(100):
+            self.request(0.1)
+        self.assertEqual(self.limiter.limit, 8)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import planner
+
+
+class ChangedFieldsTest(unittest.TestCase):
+    def test_floats(self):
+        current = {'position' : '2.00', 'speed' : 1000, 'weight' : 1.5}
+        self.assertEqual(planner.changed_fields(current, {'position' : 2.0,
+            'speed' : 1000.0, 'weight' : 2}), {'weight' : 2})
+        self.assertEqual(planner.changed_fields({'position' : None},
+            {'position' : 0.0}), {'position' : 0.0})
+
+    def test_nested(self):
+        current = {'site' : {'id' : 3, 'name' : 'par1'},
+            'type' : {'value' : '1000base-t', 'label' : '1000BASE-T'},
+            'untagged_vlan' : None, 'custom_fields' : {'rack_u' : 4}}
+        self.assertEqual(planner.changed_fields(current, {'site' : 3,
+            'type' : '1000base-t', 'custom_fields' : {'rack_u' : 4}}), {})
+        self.assertEqual(planner.changed_fields(current, {'site' : 4,
+            'type' : '10gbase-x-sfpp', 'untagged_vlan' : 12,
+            'custom_fields' : {'rack_u' : 5}}), {'site' : 4,
+            'type' : '10gbase-x-sfpp', 'untagged_vlan' : 12,
+            'custom_fields' : {'rack_u' : 5}})
+
+    def test_missing(self):
+        self.assertEqual(planner.changed_fields({}, {'mtu' : None}),
+            {'mtu' : None})
+
+
+class PlanTest(unittest.TestCase):
+    def test_placeholder_ids(self):
+        plan = planner.Plan()
+        device = plan.add('POST', 'devices', {'name' : 'web1', 'site' : 3})
+        iface = plan.add('POST', 'interfaces', {'name' : 'eth0',
+            'device' : device['id']})
+        self.assertEqual((device['id'], iface['id']), (-1, -2))
+        self.assertEqual(iface['device'], {'id' : -1})
+        self.assertEqual(device['site'], {'id' : 3})
+        self.assertTrue(planner.is_planned(iface['id']))
+        self.assertFalse(planner.is_planned(3))
+        self.assertFalse(planner.is_planned(None))
+
+    def test_lines(self):
+        plan = planner.Plan()
+        self.assertEqual(plan.add('PATCH', 'interfaces', {'id' : 7,
+            'mtu' : 9000}, 'eth0'), {'id' : 7, 'mtu' : 9000})
+        self.assertIsNone(plan.add('DELETE', 'ip-addresses', {'id' : 8},
+            '10.0.0.1/24'))
+        self.assertEqual(list(plan.lines()), [
+            'update interfaces eth0 {"mtu": 9000}',
+            'delete ip-addresses 10.0.0.1/24'])
+        self.assertEqual(len(plan), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import struct
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import dmidecode
+import smbios
+
+import fixtures
+
+# dmidecode 3.3 -t 0,1,3,4,17 on a Google Compute Engine VM (SMBIOS 2.4),
+# structures cut to the fields the decoder reads
+GCE_DMIDECODE = """# dmidecode 3.3
+Getting SMBIOS data from sysfs.
+SMBIOS 2.4 present.
+
+Handle 0x0000, DMI type 0, 24 bytes
+BIOS Information
+\tVendor: Google
+\tVersion: Google
+\tRelease Date: 07/12/2023
+
+Handle 0x0097, DMI type 1, 27 bytes
+System Information
+\tManufacturer: Google
+\tProduct Name: Google Compute Engine
+\tVersion: Not Specified
+\tSerial Number: GoogleCloud-8EBFB6FCE14327F972567743E80E23DE
+\tUUID: 8ebfb6fc-e143-27f9-7256-7743e80e23de
+\tWake-up Type: Power Switch
+\tSKU Number: Not Specified
+\tFamily: Not Specified
+
+Handle 0x0099, DMI type 3, 20 bytes
+Chassis Information
+\tManufacturer: Google
+\tType: Other
+\tLock: Not Present
+\tVersion: Not Specified
+\tSerial Number: Not Specified
+\tAsset Tag: Not Specified
+\tHeight: Unspecified
+
+Handle 0x1001, DMI type 4, 32 bytes
+Processor Information
+\tSocket Designation: CPU 1
+\tType: Central Processor
+\tFamily: Other
+\tManufacturer: Google
+\tVersion: Not Specified
+\tMax Speed: 2000 MHz
+\tCurrent Speed: 2000 MHz
+
+Handle 0x7000, DMI type 17, 21 bytes
+Memory Device
+\tArray Handle: 0x0200
+\tTotal Width: 64 bits
+\tData Width: 64 bits
+\tSize: 16 GB
+\tForm Factor: DIMM
+\tLocator: DIMM 0
+\tBank Locator: Not Specified
+\tType: RAM
+"""
+
+
+def gce_tables():
+    """The SMBIOS 2.4 structures dmidecode printed GCE_DMIDECODE from."""
+    table = b''.join([
+        fixtures.smbios_structure(0, 0x0000, 0x18, {4 : ('B', 1),
+            5 : ('B', 1), 8 : ('B', 2)}, ['Google', '07/12/2023']),
+        fixtures.smbios_structure(1, 0x0097, 0x1B, {4 : ('B', 1),
+            5 : ('B', 2), 7 : ('B', 3),
+            8 : ('16s', bytes.fromhex('8ebfb6fce14327f972567743e80e23de')),
+            0x18 : ('B', 6)}, ['Google', 'Google Compute Engine',
+            'GoogleCloud-8EBFB6FCE14327F972567743E80E23DE']),
+        fixtures.smbios_structure(3, 0x0099, 0x14, {4 : ('B', 1),
+            5 : ('B', 1)}, ['Google']),
+        fixtures.smbios_structure(4, 0x1001, 0x20, {4 : ('B', 1),
+            5 : ('B', 3), 6 : ('B', 0x01), 7 : ('B', 2), 0x14 : ('H', 2000),
+            0x16 : ('H', 2000)}, ['CPU 1', 'Google']),
+        fixtures.smbios_structure(17, 0x7000, 0x15, {4 : ('H', 0x0200),
+            0x08 : ('H', 64), 0x0A : ('H', 64), 0x0C : ('H', 16384),
+            0x0E : ('B', 0x09), 0x10 : ('B', 1), 0x12 : ('B', 0x07)},
+            ['DIMM 0']),
+        fixtures.smbios_structure(127, 0x7F00, 4, {}, [])])
+    entry_point = struct.pack('<4sBBBBHB5s5sBHIHB', b'_SM_', 0, 0x1F, 2, 4,
+        0, 0, b'', b'_DMI_', 0, len(table), 0, 6, 0x24)
+    return entry_point, table
+
+
+class FixtureTest(unittest.TestCase):
+    def test_matches_dmidecode(self):
+        # Every field decoded from the tables is printed the same way by
+        # dmidecode for the same machine
+        expected = dmidecode.parse_dmi(fixtures.dmidecode_dump(2, 8))
+        decoded = smbios.decode(*fixtures.smbios_tables(2, 8))
+        self.assertEqual([typ for typ, _ in decoded],
+            [typ for typ, _ in expected])
+        for (typ, info), (_, dmi_info) in zip(decoded, expected):
+            for key, value in info.items():
+                self.assertEqual(value, dmi_info.get(key), '{0} {1}'.format(
+                    typ, key))
+
+    def test_matches_real_dmidecode(self):
+        expected = dmidecode.parse_dmi(GCE_DMIDECODE)
+        decoded = smbios.decode(*gce_tables())
+        self.assertEqual(len(decoded), len(expected))
+        for (typ, info), (dmi_typ, dmi_info) in zip(decoded, expected):
+            self.assertEqual(typ, dmi_typ)
+            for key, value in info.items():
+                self.assertEqual(value, dmi_info.get(key), '{0} {1}'.format(
+                    typ, key))
+
+    def test_smbios_3(self):
+        entry_point, table = fixtures.smbios_tables(1, 1)
+        self.assertTrue(entry_point.startswith(b'_SM3_'))
+        self.assertEqual(smbios.smbios_version(entry_point), (3, 2))
+        # UUID fields are little-endian since SMBIOS 2.6
+        system = smbios.decode(entry_point, table)[1][1]
+        self.assertEqual(system['UUID'],
+            '4c4c4544-0042-3110-8043-b2c04f503432')
+
+    def test_extended_size(self):
+        def size(word, extended):
+            data = bytearray(0x20)
+            struct.pack_into('<HI', data, 0x0C, word, 0)
+            struct.pack_into('<I', data, 0x1C, extended)
+            return smbios.decode_memory_device(smbios.Structure(bytes(data),
+                []), (3, 2))['Size']
+        # 0x7FFF means the size in MB is in the extended field
+        self.assertEqual(size(0x7FFF, 32768), '32 GB')
+        self.assertEqual(size(0x7FFF, 0x80000000 | 1536), '1536 MB')
+        self.assertEqual(size(0x7FFF, 2 << 20), '2 TB')
+        self.assertEqual(size(0x8200, 0), '512 kB')
+        self.assertEqual(size(0, 0), 'No Module Installed')
+        self.assertEqual(size(0xFFFF, 0), 'Unknown')
+
+
+class MemorySizeTest(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(smbios.memory_size(512), '512 kB')
+        self.assertEqual(smbios.memory_size(8192 << 10), '8 GB')
+        self.assertEqual(smbios.memory_size(1536 << 10), '1536 MB')
+        self.assertEqual(smbios.memory_size(2 << 30), '2 TB')
+
+
+class ProcessorFamilyTest(unittest.TestCase):
+    def test_shared_codes(self):
+        self.assertEqual(smbios.processor_family(0xBE, 'Intel'), 'Core 2')
+        self.assertEqual(smbios.processor_family(0xBE, 'AMD'), 'K7')
+        self.assertEqual(smbios.processor_family(0x30, 'Intel(R) Corp.'),
+            'Pentium Pro')
+        self.assertEqual(smbios.processor_family(0x30, 'DEC'), 'Alpha')
+
+    def test_family_2(self):
+        self.assertEqual(smbios.processor_family(0x101, 'ARM'), 'ARMv8')
+        self.assertEqual(smbios.processor_family(0x3FF, 'ARM'),
+            '<OUT OF SPEC>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sysfs_hw
+
+XEON = """processor\t: {0}
+vendor_id\t: GenuineIntel
+model name\t: Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz
+physical id\t: {1}
+"""
+
+ARM64 = """processor\t: {0}
+BogoMIPS\t: 50.00
+Features\t: fp asimd evtstrm aes pmull sha1 sha2 crc32 atomics
+CPU implementer\t: 0x41
+CPU architecture: 8
+CPU variant\t: 0x3
+CPU part\t: 0xd0c
+CPU revision\t: 1
+"""
+
+ARM32_MACHINE = """Hardware\t: BCM2835
+Revision\t: a02082
+Serial\t\t: 00000000c0ffee00
+"""
+
+
+class CpuTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, text):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def products(self):
+        return [(cpu['bus info'], cpu['product'])
+            for cpu in sysfs_hw.get_cpus(7, self.root)]
+
+    def test_x86_sockets(self):
+        self.write('proc/cpuinfo', '\n'.join(XEON.format(cpu, cpu // 4)
+            for cpu in range(8)))
+        model = 'Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz'
+        self.assertEqual(self.products(), [('7@cpu@0', model),
+            ('7@cpu@1', model)])
+
+    def test_arm64_topology(self):
+        self.write('proc/cpuinfo', '\n'.join(ARM64.format(cpu)
+            for cpu in range(4)))
+        for cpu in range(4):
+            self.write('sys/devices/system/cpu/cpu{}/topology/'
+                'physical_package_id'.format(cpu), '{}\n'.format(cpu // 2))
+        model = 'CPU implementer 0x41 part 0xd0c'
+        self.assertEqual(self.products(), [('7@cpu@0', model),
+            ('7@cpu@1', model)])
+
+    def test_arm_without_socket(self):
+        self.write('proc/cpuinfo', '\n'.join(ARM64.format(cpu)
+            for cpu in range(4)) + '\n' + ARM32_MACHINE)
+        self.write('sys/devices/system/cpu/cpu0/topology/'
+            'physical_package_id', '-1\n')
+        self.assertEqual(self.products(), [('7@cpu@0', 'BCM2835')])
+
+
+if __name__ == '__main__':
+    unittest.main()
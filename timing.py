@@ -0,0 +1,168 @@
+"""
+Timing tree of the phases and probes of an agent run.
+
+    with timing.run('sync') as root:
+        with timing.span('update_interfaces'):
+            ...
+    logging.info(root.format())
+
+Spans opened outside of a run record nothing. Spans of the same name under
+one parent are merged and counted, so a probe run once per interface is a
+single line of the tree. Spans opened from several threads at once (see
+AsyncNetBoxClient.call) add up their durations, so children can total more
+than their parent.
+"""
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+current = contextvars.ContextVar('timing_span', default=None)
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+
+class Span():
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def child(self, name):
+        with self.lock:
+            if name not in self.children:
+                self.children[name] = Span(name)
+            return self.children[name]
+
+    def add(self, elapsed):
+        with self.lock:
+            self.count += 1
+            self.total += elapsed
+
+    def to_dict(self):
+        return {'name' : self.name, 'count' : self.count,
+            'seconds' : self.total, 'children' : [child.to_dict()
+            for child in list(self.children.values())]}
+
+    def lines(self, run_total=None, depth=0):
+        if run_total is None:
+            run_total = self.total
+        share = 100 * self.total / run_total if run_total else 0
+        lines = ['{0:<44} {1:>6} {2:>10.1f} {3:>5.0f}%'.format(
+            '  ' * depth + self.name, self.count, self.total * 1e3, share)]
+        for child in list(self.children.values()):
+            lines += child.lines(run_total, depth + 1)
+        return lines
+
+    def format(self):
+        return '\n'.join(['{0:<44} {1:>6} {2:>10} {3:>6}'.format('span',
+            'count', 'ms', 'run')] + self.lines())
+
+
+@contextlib.contextmanager
+def span(name):
+    parent = current.get()
+    if parent is None:
+        yield None
+        return
+    node = parent.child(name)
+    token = current.set(node)
+    start = time.perf_counter()
+    try:
+        yield node
+    finally:
+        node.add(time.perf_counter() - start)
+        current.reset(token)
+
+
+def timed(name):
+    """Decorator running each call of the function in a span."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def run(name):
+    """
+    Start a new timing tree: spans opened inside are recorded under the
+    root span yielded, not under a run that was already active.
+    """
+    root = Span(name)
+    token = current.set(root)
+    start = time.perf_counter()
+    try:
+        yield root
+    finally:
+        root.add(time.perf_counter() - start)
+        current.reset(token)
+
+
+def command_name(cmd):
+    """
+    Span name of a shell command: the program and its leading options,
+    without sudo, environment assignments and per-call arguments.
+    """
+    words = [w for w in cmd.split() if w not in ('sudo', '-S') and
+        '=' not in w]
+    name = words[:1]
+    for word in words[1:]:
+        if not word.startswith('-'):
+            break
+        name.append(word)
+    return 'run ' + ' '.join(name)
+
+
+def timed_command(func):
+    """Decorator running each call of func(cmd, ...) in a span of cmd."""
+    @functools.wraps(func)
+    def wrapper(cmd, *args, **kwargs):
+        with span(command_name(cmd)):
+            return func(cmd, *args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def profiled(profiler, output=None, top=30):
+    """
+    Profile the enclosed code with cProfile or tracemalloc. The top
+    functions by cumulative time, or lines by allocated memory, are printed
+    at the end; output also gets the pstats or tracemalloc snapshot dump.
+    cProfile only sees the calling thread, so work run on the
+    AsyncNetBoxClient thread pool shows up as time waiting for it.
+    """
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            if output:
+                prof.dump_stats(output)
+            pstats.Stats(prof).sort_stats('cumulative').print_stats(top)
+    elif profiler == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snap = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if output:
+                snap.dump(output)
+            print('Peak traced memory: {:.1f} MB'.format(peak / 1e6))
+            for stat in snap.statistics('lineno')[:top]:
+                print(stat)
+    else:
+        raise ValueError('Unknown profiler ' + profiler)